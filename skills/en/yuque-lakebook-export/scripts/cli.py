@@ -1,8 +1,11 @@
 import argparse
+import cProfile
 import os
+import pstats
 from pathlib import Path
 import glob
 import sys
+import time
 import curses
 from datetime import datetime
 import json
@@ -12,11 +15,33 @@ try:
 except ImportError:
     readline = None
 
+from yuque_lakebook_export.lake_dom import (
+    DEFAULT_PARSER_BACKEND,
+    PARSER_BACKENDS,
+    parser_backend_available,
+    parser_backend_unavailable_message,
+)
+from yuque_lakebook_export.lake_download import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_PER_HOST_LIMIT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RATE_LIMIT,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_RETRIES,
+    diff_session_stats,
+    get_shared_session,
+)
 from yuque_lakebook_export.lake_handle import sanitize_path_segment
-from yuque_lakebook_export.lake_setup import start_convert
+from yuque_lakebook_export.lake_setup import start_convert, start_parallel_convert
+from yuque_lakebook_export.lake_timing import format_counters, format_stages
 
 
 STATE_FILE = Path.home() / ".agents" / "state" / "yuque-lakebook-export.json"
+ASSET_CACHE_DIR = Path.home() / ".agents" / "cache" / "yuque-lakebook-export" / "assets"
+TOC_CACHE_DIR = Path.home() / ".agents" / "cache" / "yuque-lakebook-export" / "toc"
+DEFAULT_PROFILE_PATH = "yuque-lakebook-export.pstats"
+PROFILE_TOP_FUNCTIONS = 25
 
 
 def parse_bool(value):
@@ -270,15 +295,33 @@ def get_log_output_dir(lakebooks):
     return Path(common_dir)
 
 
-def run_batch(lakebooks, output_root, download_image, skip_existing, open_output=False):
+def run_batch(lakebooks, output_root, download_image, skip_existing, open_output=False, convert_options=None,
+              parallel_books=1):
     output_root = output_root.expanduser().resolve()
     output_root.mkdir(parents=True, exist_ok=True)
+    started_at = time.perf_counter()
+    if parallel_books > 1 and len(lakebooks) > 1:
+        batch_results, batch_info = run_batch_parallel(lakebooks, output_root, download_image, skip_existing,
+                                                       open_output, convert_options, parallel_books)
+    else:
+        batch_results, batch_info = run_batch_sequential(lakebooks, output_root, download_image, skip_existing,
+                                                         open_output, convert_options)
+    batch_info["elapsed"] = round(time.perf_counter() - started_at, 3)
+    log_dir = get_log_output_dir(lakebooks)
+    log_path = write_batch_log(batch_results, log_dir, batch_info)
+    print_batch_summary(batch_results)
+    if log_path:
+        print(f">>> 执行日志: {log_path}")
+
+
+def run_batch_sequential(lakebooks, output_root, download_image, skip_existing, open_output, convert_options):
     batch_results = []
     for lakebook in lakebooks:
         target_dir = build_output_dir(output_root, lakebook)
         print(f"\n>>> 开始处理: {lakebook}")
         print(f">>> 输出目录: {target_dir}")
-        result = start_convert(None, str(lakebook), str(target_dir), download_image, skip_existing, open_output=open_output)
+        result = start_convert(None, str(lakebook), str(target_dir), download_image, skip_existing, open_output=open_output,
+                               **(convert_options or {}))
         batch_results.append({
             "lakebook": str(lakebook),
             "target_dir": str(target_dir),
@@ -286,11 +329,32 @@ def run_batch(lakebooks, output_root, download_image, skip_existing, open_output
         })
         if result and not result.get("success"):
             print(f">>> 当前文件处理失败，继续下一个: {lakebook}")
-    log_dir = get_log_output_dir(lakebooks)
-    log_path = write_batch_log(batch_results, log_dir)
-    print_batch_summary(batch_results)
-    if log_path:
-        print(f">>> 执行日志: {log_path}")
+    return batch_results, {"parallel_books": 1}
+
+
+def run_batch_parallel(lakebooks, output_root, download_image, skip_existing, open_output, convert_options,
+                       parallel_books):
+    """
+    同时处理 parallel_books 个 lakebook，转换进程和下载线程为整批共用的预算，进度汇总为一行
+    """
+    convert_options = dict(convert_options or {})
+    books = [(str(lakebook), str(build_output_dir(output_root, lakebook))) for lakebook in lakebooks]
+    print(f"\n>>> 同时处理 {min(parallel_books, len(books))} 个 lakebook，共 {len(books)} 个")
+    for lakebook, target_dir in books:
+        print(f">>> {lakebook} -> {target_dir}")
+    session = get_shared_session(**(convert_options.get("session_options") or {}))
+    session_stats_before = session.stats()
+    results = start_parallel_convert(books, download_image, skip_existing, open_output=open_output,
+                                     parallel_books=parallel_books, **convert_options)
+    batch_results = []
+    for (lakebook, target_dir), result in zip(books, results):
+        batch_results.append({
+            "lakebook": lakebook,
+            "target_dir": target_dir,
+            **(result or {})
+        })
+    http_stats = diff_session_stats(session_stats_before, session.stats())
+    return batch_results, {"parallel_books": parallel_books, "http_stats": http_stats}
 
 
 def print_batch_summary(batch_results):
@@ -314,7 +378,27 @@ def print_batch_summary(batch_results):
             print(f"  错误: {item.get('error') or '未知错误'}")
 
 
-def write_batch_log(batch_results, log_dir):
+def format_http_stats(http_stats):
+    requests_count = http_stats.get("requests", 0)
+    reused = http_stats.get("reused", 0)
+    reuse_rate = reused / requests_count * 100 if requests_count else 0
+    return (f"请求 {requests_count}，新建连接 {http_stats.get('connections', 0)}，"
+            f"复用连接 {reused} ({reuse_rate:.1f}%)")
+
+
+def format_elapsed(item):
+    elapsed = item.get("elapsed") or 0
+    file_count = item.get("file_count", 0)
+    rate = file_count / elapsed if elapsed else 0
+    return f"{elapsed:.1f} 秒 ({rate:.1f} 篇/秒)"
+
+
+def write_batch_log(batch_results, log_dir, batch_info=None):
+    """
+    :param batch_info: 整批信息：总耗时 elapsed、同时处理的 lakebook 数 parallel_books，
+                       以及并行时整批的 HTTP 连接统计 http_stats
+    """
+    batch_info = batch_info or {}
     if not batch_results or log_dir is None:
         return None
     timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -324,14 +408,46 @@ def write_batch_log(batch_results, log_dir):
         f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
         f"成功数量: {len([item for item in batch_results if item.get('success')])}",
         f"失败数量: {len([item for item in batch_results if not item.get('success')])}",
-        ""
     ]
+    if batch_info.get("elapsed") is not None:
+        lines.append(f"总耗时: {batch_info['elapsed']:.1f} 秒")
+    if batch_info.get("parallel_books", 1) > 1:
+        lines.append(f"同时处理的 lakebook 数: {batch_info['parallel_books']}")
+    total_http_stats = dict(batch_info.get("http_stats") or {})
+    if not total_http_stats:
+        for item in batch_results:
+            for key, value in (item.get("http_stats") or {}).items():
+                total_http_stats[key] = total_http_stats.get(key, 0) + value
+    if total_http_stats:
+        lines.append(f"HTTP 连接统计: {format_http_stats(total_http_stats)}")
+    lines.append("")
 
     for item in batch_results:
         lines.append(f"源文件: {item.get('lakebook')}")
         lines.append(f"输出目录: {item.get('target_dir')}")
         lines.append(f"执行结果: {'成功' if item.get('success') else '失败'}")
         lines.append(f"导出文件数: {item.get('file_count', 0)}")
+        lines.append(f"耗时: {format_elapsed(item)}")
+        if (item.get("timings") or {}).get("stages"):
+            lines.append(f"阶段耗时: {format_stages(item['timings'])}")
+            lines.append(f"计数: {format_counters(item['timings'])}")
+        download_stats = item.get("download_stats") or {}
+        if download_stats:
+            lines.append(f"资源下载: 下载 {download_stats.get('downloaded', 0)}，"
+                         f"缓存命中 {download_stats.get('cache_hits', 0)}")
+        incremental_stats = item.get("incremental") or {}
+        if incremental_stats:
+            lines.append(f"增量导出: 转换 {incremental_stats.get('converted', 0)}，"
+                         f"移动 {incremental_stats.get('moved', 0)}，"
+                         f"未变化 {incremental_stats.get('unchanged', 0)}，"
+                         f"删除 {incremental_stats.get('deleted', 0)}")
+        if item.get("http_stats"):
+            lines.append(f"HTTP 连接统计: {format_http_stats(item['http_stats'])}")
+        unresolved_links = item.get("unresolved_links") or []
+        if unresolved_links:
+            lines.append(f"未解析的内部链接: {len(unresolved_links)}")
+            for link in unresolved_links:
+                lines.append(f"  - {link['doc']}: [{link['title']}]({link['src']})")
         if item.get("error"):
             lines.append(f"错误信息: {item.get('error')}")
         if item.get("traceback"):
@@ -355,7 +471,7 @@ def confirm_execution():
     return confirm in {"", "y", "yes"}
 
 
-def run_interactive(download_image, skip_existing, open_output=False):
+def run_interactive(download_image, skip_existing, open_output=False, convert_options=None, parallel_books=1):
     state = load_state()
     lakebooks, search_dir = prompt_lakebooks(state)
     if not lakebooks:
@@ -366,7 +482,8 @@ def run_interactive(download_image, skip_existing, open_output=False):
     if not confirm_execution():
         print("已取消执行")
         return
-    run_batch(lakebooks, output_root, download_image, skip_existing, open_output=open_output)
+    run_batch(lakebooks, output_root, download_image, skip_existing, open_output=open_output,
+              convert_options=convert_options, parallel_books=parallel_books)
     save_state({
         "last_search_dir": str(search_dir),
         "last_output_root": str(output_root.expanduser().resolve()),
@@ -374,35 +491,115 @@ def run_interactive(download_image, skip_existing, open_output=False):
     })
 
 
-if __name__ == '__main__':
-    setup_readline()
-    parser = argparse.ArgumentParser(
-        description="Export one or more Yuque .lakebook files into local Markdown folders for Obsidian."
-    )
-    parser.add_argument('-i', '--meta', help="lake文件的meta.json路径", type=str)
-    parser.add_argument('-l', '--lake', help="lakebook文件路径，支持多个", nargs='*')
-    parser.add_argument('-o', '--output', help="生成markdown的根路径", type=str)
-    parser.add_argument('-d', '--downloadImage', help="是否下载图片", type=parse_bool, default=True)
-    parser.add_argument('-s', '--skip-existing-resources', help="是否跳过本地已存在的图片和附件文件", action='store_true')
-    parser.add_argument('--open-output', help="导出成功后自动打开目标目录", action='store_true')
-    parser.add_argument('--interactive', help="启用交互式选择", action='store_true')
-    args = parser.parse_args()
-
+def run_cli(args, convert_options):
     is_interactive_mode = args.interactive or (not args.meta and not args.lake)
     if is_interactive_mode:
-        run_interactive(args.downloadImage, args.skip_existing_resources, open_output=args.open_output)
+        run_interactive(args.downloadImage, args.skip_existing_resources, open_output=args.open_output,
+                        convert_options=convert_options, parallel_books=args.parallel_books)
     elif args.meta:
         start_convert(args.meta, None, args.output, args.downloadImage, args.skip_existing_resources,
-                      open_output=args.open_output)
+                      open_output=args.open_output, **convert_options)
     else:
         lakebooks = [Path(item).expanduser().resolve() for item in args.lake]
         if len(lakebooks) == 1 and args.output:
             output_root = Path(args.output).expanduser()
             target_dir = build_output_dir(output_root, lakebooks[0])
             start_convert(None, str(lakebooks[0]), str(target_dir), args.downloadImage, args.skip_existing_resources,
-                          open_output=args.open_output)
+                          open_output=args.open_output, **convert_options)
         else:
             default_output_root = lakebooks[0].parent if lakebooks else Path.cwd()
             output_root = Path(args.output).expanduser() if args.output else default_output_root
             run_batch(lakebooks, output_root, args.downloadImage, args.skip_existing_resources,
-                      open_output=args.open_output)
+                      open_output=args.open_output, convert_options=convert_options,
+                      parallel_books=args.parallel_books)
+
+
+def run_profiled(profile_path, func, *args):
+    """
+    用 cProfile 运行 func，结果写入 profile_path（可用 python -m pstats 查看），并打印累计耗时最多的函数。
+    只统计主进程主线程：--workers 大于 1 时的转换进程、下载线程和 --parallel-books 的各 lakebook 线程不在其中
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        profile_path = Path(profile_path).expanduser().resolve()
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(profile_path))
+        print(f"\n>>> 性能分析结果: {profile_path}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+
+
+if __name__ == '__main__':
+    setup_readline()
+    parser = argparse.ArgumentParser(
+        description="Export one or more Yuque .lakebook files into local Markdown folders for Obsidian."
+    )
+    parser.add_argument('-i', '--meta', help="lake文件的meta.json路径", type=str)
+    parser.add_argument('-l', '--lake', help="lakebook文件路径，支持多个", nargs='*')
+    parser.add_argument('-o', '--output', help="生成markdown的根路径", type=str)
+    parser.add_argument('-d', '--downloadImage', help="是否下载图片", type=parse_bool, default=True)
+    parser.add_argument('-s', '--skip-existing-resources', help="是否跳过本地已存在的图片和附件文件", action='store_true')
+    parser.add_argument('--open-output', help="导出成功后自动打开目标目录", action='store_true')
+    parser.add_argument('--interactive', help="启用交互式选择", action='store_true')
+    parser.add_argument('--download-workers', help=f"图片和附件的并发下载线程数(默认 {DEFAULT_DOWNLOAD_WORKERS})",
+                        type=int, default=DEFAULT_DOWNLOAD_WORKERS)
+    parser.add_argument('--per-host-limit', help=f"同一域名的最大并发下载数(默认 {DEFAULT_PER_HOST_LIMIT})",
+                        type=int, default=DEFAULT_PER_HOST_LIMIT)
+    parser.add_argument('--rate-limit', help=f"每秒最多发起的下载请求数，0 表示不限速(默认 {DEFAULT_RATE_LIMIT:g})",
+                        type=float, default=DEFAULT_RATE_LIMIT)
+    parser.add_argument('--retries', help=f"下载失败后的最大重试次数(默认 {DEFAULT_RETRIES})",
+                        type=int, default=DEFAULT_RETRIES)
+    parser.add_argument('--pool-size', help=f"HTTP 连接池中每个域名保留的 keep-alive 连接数(默认 {DEFAULT_POOL_SIZE})",
+                        type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument('--connect-timeout', help=f"建立连接超时秒数(默认 {DEFAULT_CONNECT_TIMEOUT:g})",
+                        type=float, default=DEFAULT_CONNECT_TIMEOUT)
+    parser.add_argument('--read-timeout', help=f"读取响应超时秒数(默认 {DEFAULT_READ_TIMEOUT:g})",
+                        type=float, default=DEFAULT_READ_TIMEOUT)
+    parser.add_argument('--workers', help="并行转换文档的进程数，1 表示顺序转换(默认 1)", type=int, default=1)
+    parser.add_argument('--asset-cache', help=f"跨文档、跨运行共享的图片和附件缓存目录(默认 {ASSET_CACHE_DIR})",
+                        type=str, default=str(ASSET_CACHE_DIR))
+    parser.add_argument('--no-asset-cache', help="不使用资源缓存，每篇文档单独下载", action='store_true')
+    parser.add_argument('--link-assets', help="资源用硬链接指向缓存而不是复制，节省磁盘空间，"
+                                              "但直接修改导出的图片会改动缓存中的文件", action='store_true')
+    parser.add_argument('--toc-cache', help=f"解析后的目录缓存目录，同一本书再次导出时跳过目录解析(默认 {TOC_CACHE_DIR})",
+                        type=str, default=str(TOC_CACHE_DIR))
+    parser.add_argument('--no-toc-cache', help="不使用目录缓存，每次都解析目录", action='store_true')
+    parser.add_argument('--parser', help=f"正文解析后端，auto 使用与 bs4 输出一致的 htmlparser，不可用时使用 bs4(默认 {DEFAULT_PARSER_BACKEND})",
+                        choices=PARSER_BACKENDS, default=DEFAULT_PARSER_BACKEND)
+    parser.add_argument('--parallel-books', help="批量导出时同时处理的 lakebook 数(默认 1)；"
+                                                 "--workers 和 --download-workers 为整批共用的总数",
+                        type=int, default=1)
+    parser.add_argument('--profile', help=f"用 cProfile 分析导出过程并写入指定文件(默认 {DEFAULT_PROFILE_PATH})",
+                        nargs='?', const=DEFAULT_PROFILE_PATH, default=None)
+    parser.add_argument('--incremental', help="增量导出：按输出目录中的清单只转换新增或变化的文档，移动改名的文档并删除已移除的文档",
+                        action='store_true')
+    args = parser.parse_args()
+    if not parser_backend_available(args.parser):
+        parser.error(parser_backend_unavailable_message(args.parser))
+    convert_options = {
+        "asset_cache_dir": None if args.no_asset_cache else args.asset_cache,
+        "link_assets": args.link_assets,
+        "toc_cache_dir": None if args.no_toc_cache else args.toc_cache,
+        "workers": args.workers,
+        "parser_backend": args.parser,
+        "incremental": args.incremental,
+        "download_options": {
+            "max_workers": args.download_workers,
+            "per_host_limit": args.per_host_limit,
+            "rate_limit": args.rate_limit,
+            "retries": args.retries,
+        },
+        "session_options": {
+            "pool_size": args.pool_size,
+            "connect_timeout": args.connect_timeout,
+            "read_timeout": args.read_timeout,
+        },
+    }
+
+    if args.profile:
+        run_profiled(args.profile, run_cli, args, convert_options)
+    else:
+        run_cli(args, convert_options)
@@ -0,0 +1,198 @@
+"""
+增量导出清单。输出目录下的 .yuque-export-manifest.json 按文档 uuid 记录：
+来源 json 的 sha256、导出的 Markdown 路径、正文中引用的其他文档当时解析到的路径、找不到目标的语雀链接，
+以及资源是否全部下载成功；
+另外记录目录树中的目录，分组改名后清理留下的空目录。
+再次导出时只转换新增或变化的文档，移动改名的文档，删除 lakebook 中已移除的文档。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+MANIFEST_NAME = ".yuque-export-manifest.json"
+# 转换规则变化导致同一来源的输出不同时递增，旧清单中的文档会全部重新转换
+MANIFEST_VERSION = 1
+
+
+def source_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def assets_dir_of(md_path):
+    """
+    文档的资源目录与 Markdown 同名，后缀为 .assets
+    """
+    return md_path[:-len(".md")] + ".assets"
+
+
+class ExportManifest:
+    """
+    :param output_dir: 导出根目录，清单中的路径都相对于这个目录保存
+    :param options: 影响输出内容的导出参数（是否下载图片、解析后端等），与上次不同时全部重新转换
+    """
+
+    def __init__(self, output_dir, options=None):
+        self.output_dir = os.path.abspath(output_dir)
+        self.path = os.path.join(self.output_dir, MANIFEST_NAME)
+        self.options = dict(options or {})
+        self.options_changed = False
+        # 上次导出的记录和本次导出的记录：{uuid: {"hash", "path", "links", "unresolved", "complete"}}
+        self.previous = {}
+        self.documents = {}
+        self.previous_dirs = []
+        self.dirs = []
+        # 本次需要转换的文档的来源哈希
+        self.hashes = {}
+        self.stats = {"converted": 0, "moved": 0, "unchanged": 0, "deleted": 0}
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        self.options_changed = data.get("version") != MANIFEST_VERSION or data.get("options") != self.options
+        documents = data.get("documents") or {}
+        self.previous = {uuid: entry for uuid, entry in documents.items()
+                         if isinstance(entry, dict) and isinstance(entry.get("path"), str)}
+        self.previous_dirs = [path for path in data.get("dirs") or [] if isinstance(path, str)]
+
+    def save(self):
+        data = {"version": MANIFEST_VERSION, "options": self.options, "documents": self.documents, "dirs": self.dirs}
+        os.makedirs(self.output_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.output_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+                json.dump(data, fp, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def relative(self, path):
+        if not path:
+            return None
+        return os.path.relpath(os.path.abspath(path), self.output_dir).replace(os.path.sep, "/")
+
+    def absolute(self, relative_path):
+        """
+        :return: 清单中的相对路径对应的绝对路径，路径不在导出目录内时返回 None
+        """
+        path = os.path.abspath(os.path.join(self.output_dir, relative_path))
+        if os.path.commonpath([path, self.output_dir]) != self.output_dir or path == self.output_dir:
+            return None
+        return path
+
+    def links_unchanged(self, entry, doc_path_map):
+        links = entry.get("links") or {}
+        return all(self.relative(doc_path_map.get(key)) == path for key, path in links.items())
+
+    def plan(self, documents, doc_path_map, keep_dirs=()):
+        """
+        对比上次的清单，移动改名的文档、删除已移除的文档，返回需要转换的文档
+        :param documents: [(uuid, Markdown 路径, 来源哈希), ...]
+        :param doc_path_map: 本次的文档路径表，用来判断引用的文档是否改了路径
+        :param keep_dirs: 本次目录树中的目录，删除文档后不清理这些空目录
+        :return: 需要转换的文档 uuid 集合
+        """
+        to_convert = set()
+        current_paths = {self.relative(md_path) for _, md_path, _ in documents}
+        for uuid, md_path, digest in documents:
+            entry = self.previous.get(uuid)
+            relative_path = self.relative(md_path)
+            if (entry is not None and not self.options_changed and entry.get("complete")
+                    and entry.get("hash") == digest and entry["path"] == relative_path
+                    and self.links_unchanged(entry, doc_path_map) and os.path.exists(md_path)):
+                self.documents[uuid] = entry
+                self.stats["unchanged"] += 1
+                continue
+            if entry is not None and entry["path"] != relative_path:
+                # 改名或移动了目录：先把旧文件和资源目录挪过去，正文里的相对链接随后重新转换
+                old_path = self.absolute(entry["path"])
+                if old_path is not None and entry["path"] not in current_paths and self.move(old_path, md_path):
+                    self.stats["moved"] += 1
+                    self.prune_dirs(os.path.dirname(old_path), keep_dirs)
+            self.hashes[uuid] = digest
+            to_convert.add(uuid)
+
+        for uuid, entry in self.previous.items():
+            if uuid in self.hashes or uuid in self.documents or entry["path"] in current_paths:
+                continue
+            old_path = self.absolute(entry["path"])
+            if old_path is not None and self.delete(old_path):
+                self.stats["deleted"] += 1
+                self.prune_dirs(os.path.dirname(old_path), keep_dirs)
+
+        self.dirs = sorted(self.relative(directory) for directory in keep_dirs)
+        # 深的目录先处理，子目录删掉后父目录才可能变空
+        for relative_dir in sorted(set(self.previous_dirs) - set(self.dirs), key=len, reverse=True):
+            directory = self.absolute(relative_dir)
+            if directory is not None:
+                self.prune_dirs(directory, keep_dirs)
+        self.stats["converted"] = len(to_convert)
+        return to_convert
+
+    def record(self, uuid, md_path, linked_docs, failures, unresolved_links=()):
+        """
+        记录一篇已写出的文档，资源有下载失败时下次导出会重新转换
+        :param linked_docs: {正文中引用的文档标识: 当时解析到的路径或 None}
+        :param unresolved_links: 找不到目标文档的语雀链接 [(链接标题, 原链接), ...]，文档未变化时仍列入链接报告
+        """
+        self.documents[uuid] = {
+            "hash": self.hashes.get(uuid),
+            "path": self.relative(md_path),
+            "links": {key: self.relative(path) for key, path in linked_docs.items()},
+            "unresolved": [list(link) for link in unresolved_links],
+            "complete": not failures,
+        }
+
+    def unchanged_unresolved_links(self):
+        """
+        :return: 本次跳过的文档中找不到目标的语雀链接 [(Markdown 路径, [(链接标题, 原链接), ...]), ...]
+        """
+        result = []
+        for uuid, entry in self.documents.items():
+            md_path = self.absolute(entry["path"])
+            links = [tuple(link) for link in entry.get("unresolved") or [] if isinstance(link, list) and len(link) == 2]
+            if uuid not in self.hashes and md_path is not None and links:
+                result.append((md_path, links))
+        return result
+
+    @staticmethod
+    def move(old_path, new_path):
+        if not os.path.exists(old_path) or os.path.exists(new_path):
+            return False
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+        old_assets, new_assets = assets_dir_of(old_path), assets_dir_of(new_path)
+        if os.path.isdir(old_assets) and not os.path.exists(new_assets):
+            shutil.move(old_assets, new_assets)
+        return True
+
+    @staticmethod
+    def delete(md_path):
+        if not os.path.exists(md_path):
+            return False
+        os.remove(md_path)
+        assets = assets_dir_of(md_path)
+        if os.path.isdir(assets):
+            shutil.rmtree(assets, ignore_errors=True)
+        return True
+
+    def prune_dirs(self, directory, keep_dirs):
+        """
+        自下而上删除文档移走后留下的空目录，不越过导出根目录
+        """
+        while directory != self.output_dir and directory not in keep_dirs:
+            if os.path.commonpath([directory, self.output_dir]) != self.output_dir:
+                return
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
@@ -1,23 +1,21 @@
+import hashlib
+import json
+import mmap
 import os.path
+import pickle
 import tarfile
+import tempfile
 
-__EMPTY_ = 0x00
-__HEAD_LEN_ = 512
+import yaml
 
+try:
+    # libyaml 的 C 实现，比纯 Python 的 yaml.Loader 快数倍
+    from yaml import CSafeLoader as TocLoader
+except ImportError:
+    from yaml import SafeLoader as TocLoader
 
-def unpack_lake_book_file(lake_file, extract_to):
-    """
-    将lakebook文件抽出到指定目录
-    :param lake_file: lakebook文件
-    :param extract_to: 指定目录
-    :return: meta.json的目录
-    """
-    if not os.path.exists(extract_to):
-        os.makedirs(extract_to)
-    with tarfile.open(lake_file, 'r') as tar_ref:
-        tar_ref.extractall(extract_to)
-    secondary_dir_name = get_lake_book_dir_name(lake_book_path=lake_file)
-    return os.path.join(extract_to, secondary_dir_name)
+__EMPTY_ = 0x00
+__HEAD_LEN_ = 512
 
 
 def get_lake_book_dir_name(lake_book_path):
@@ -40,3 +38,153 @@ def get_file_name(head_block):
         else:
             file_name_byte.append(b)
     return bytes(file_name_byte).decode("utf-8")
+
+
+class LakeBookDirectory:
+    """
+    从已解压的 lakebook 目录读取 $meta.json 和文档 json
+    """
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+
+    def read_bytes(self, name):
+        with open(os.path.join(self.root_path, name), 'rb') as fp:
+            return fp.read()
+
+    def read_json(self, name):
+        with open(os.path.join(self.root_path, name), 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LakeBookArchive:
+    """
+    不解压 lakebook，直接从 tar 中读取 $meta.json 和文档 json。
+    首次使用时扫描一遍 tar 头建立成员索引；未压缩的 tar 通过 mmap 按偏移读取成员内容，
+    压缩包则退化为 tarfile.extractfile。对象可被 pickle 传给转换进程，在子进程中重新打开。
+    """
+
+    def __init__(self, lake_file):
+        self.lake_file = lake_file
+        self.prefix = ""
+        self._tar = None
+        self._fp = None
+        self._mmap = None
+        self._members = None
+
+    def __getstate__(self):
+        return {"lake_file": self.lake_file}
+
+    def __setstate__(self, state):
+        self.__init__(state["lake_file"])
+
+    def open(self):
+        if self._members is not None:
+            return
+        try:
+            self._tar = tarfile.open(self.lake_file, 'r:')
+        except tarfile.ReadError:
+            # 压缩的 tar 无法按偏移随机读取
+            self._tar = tarfile.open(self.lake_file, 'r:*')
+        else:
+            self._fp = open(self.lake_file, 'rb')
+            if os.fstat(self._fp.fileno()).st_size > 0:
+                self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        tar_members = self._tar.getmembers()
+        # 与 get_lake_book_dir_name 一致：以第一个 tar 成员所在目录作为书籍目录
+        self.prefix = os.path.dirname(tar_members[0].name) if tar_members else ""
+        all_members = [member for member in tar_members if member.isfile()]
+        if not any(member.name == self.join_prefix("$meta.json") for member in all_members):
+            # 首个 tar 头不在书籍目录下时，以 $meta.json 所在目录为准
+            for member in all_members:
+                if os.path.basename(member.name) == "$meta.json":
+                    self.prefix = os.path.dirname(member.name)
+                    break
+        base = self.join_prefix("")
+        self._members = {
+            member.name[len(base):]: member for member in all_members if member.name.startswith(base)
+        }
+
+    def join_prefix(self, name):
+        return self.prefix + "/" + name if self.prefix else name
+
+    def read_bytes(self, name):
+        self.open()
+        member = self._members.get(name)
+        if member is None:
+            raise FileNotFoundError("lakebook 中不存在文件: {}".format(name))
+        if self._mmap is not None and not member.issparse():
+            return self._mmap[member.offset_data:member.offset_data + member.size]
+        return self._tar.extractfile(member).read()
+
+    def read_json(self, name):
+        return json.loads(self.read_bytes(name))
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._fp is not None:
+            self._fp.close()
+        if self._tar is not None:
+            self._tar.close()
+        self._tar = None
+        self._fp = None
+        self._mmap = None
+        self._members = None
+
+
+def load_toc_yaml(book_yml):
+    """
+    解析 $meta.json 中的 tocYml，目录只含普通的映射、列表和标量，使用 SafeLoader 即可
+    """
+    return yaml.load(book_yml, TocLoader)
+
+
+# 缓存内容的结构变化时递增，旧缓存自动失效
+TOC_CACHE_VERSION = 1
+
+
+class TocCache:
+    """
+    解析后的目录缓存：以 $meta.json 内容的 sha256 为键，用 pickle 保存整理好的目录结构，
+    同一本书再次导出（或被多个转换进程读取）时跳过 JSON 和 YAML 解析。缓存损坏或版本不符时视为未命中。
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(os.path.expanduser(str(root)))
+
+    @staticmethod
+    def key(meta_bytes):
+        return hashlib.sha256(meta_bytes).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + ".pickle")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as fp:
+                version, toc = pickle.load(fp)
+        except Exception:
+            return None
+        return toc if version == TOC_CACHE_VERSION else None
+
+    def put(self, key, toc):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump((TOC_CACHE_VERSION, toc), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
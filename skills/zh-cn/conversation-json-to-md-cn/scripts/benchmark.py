@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""Benchmarks and synthetic export generator for convert_conversations.py."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from convert_conversations import (
+    FAST_JSON_LOADERS,
+    demote_response_headings,
+    load_json,
+    normalize_root,
+    render_conversation,
+    unique_filename,
+)
+
+
+EXPORT_SHAPES = ("mapping", "fragments", "messages", "chat-messages", "pairs", "history")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the conversation-json-to-md converter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    render = subparsers.add_parser(
+        "render",
+        help="Compare demote_response_headings with the previous per-line implementation",
+    )
+    render.add_argument("--size-mb", type=float, default=100.0, help="Synthetic answer corpus size (default: 100)")
+    render.add_argument("--answer-kb", type=float, default=16.0, help="Average answer size (default: 16)")
+    render.add_argument("--repeat", type=int, default=3, help="Runs per implementation; best time wins (default: 3)")
+    render.add_argument("--seed", type=int, default=0, help="Random seed for the corpus (default: 0)")
+
+    generate = subparsers.add_parser("generate", help="Write a synthetic chat export")
+    generate.add_argument("--shape", choices=EXPORT_SHAPES, default="mapping", help="Export shape (default: mapping)")
+    generate.add_argument("--output", required=True, help="Path of the JSON file to write")
+    add_size_arguments(generate)
+
+    pipeline = subparsers.add_parser(
+        "pipeline",
+        help="Time the load, normalize, render and write stages on synthetic exports",
+    )
+    pipeline.add_argument(
+        "--shape",
+        choices=EXPORT_SHAPES,
+        action="append",
+        help="Export shape to benchmark; repeat for several (default: all shapes)",
+    )
+    pipeline.add_argument(
+        "--loader",
+        choices=("auto", *FAST_JSON_LOADERS, "json"),
+        default="auto",
+        help="JSON backend for the load stage, as in convert_conversations.py (default: auto)",
+    )
+    add_size_arguments(pipeline)
+    return parser.parse_args()
+
+
+def add_size_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--conversations", type=int, default=1000, help="Conversations per export (default: 1000)")
+    parser.add_argument("--turns", type=int, default=8, help="Question/answer pairs per conversation (default: 8)")
+    parser.add_argument("--answer-kb", type=float, default=4.0, help="Average answer size (default: 4)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+
+
+def legacy_demote_response_headings(markdown: str) -> str:
+    """The per-line `re.match` implementation, kept as the benchmark baseline."""
+    lines = markdown.splitlines()
+    result: list[str] = []
+    in_code_block = False
+    for line in lines:
+        if re.match(r"^\s*```", line):
+            in_code_block = not in_code_block
+            result.append(line)
+            continue
+        if in_code_block:
+            result.append(line)
+            continue
+        match = re.match(r"^(\s*)(#{1,6})(\s+.*)$", line)
+        if not match:
+            result.append(line)
+            continue
+        indent, hashes, rest = match.groups()
+        level = min(6, len(hashes) + 1)
+        result.append(f"{indent}{'#' * level}{rest}")
+    return "\n".join(result).strip()
+
+
+def synthetic_answer(rng: random.Random, target_chars: int) -> str:
+    """Build an answer that mixes prose, headings, lists and large code dumps."""
+    blocks: list[str] = []
+    size = 0
+    while size < target_chars:
+        kind = rng.random()
+        if kind < 0.15:
+            block = f"{'#' * rng.randint(1, 4)} Section {rng.randint(1, 999)}"
+        elif kind < 0.45:
+            language = rng.choice(["python", "bash", "json", ""])
+            body = "\n".join(
+                rng.choice(
+                    [
+                        f"    value_{index} = compute({index})",
+                        f"# comment {index} that looks like a heading",
+                        f"print('line {index}')",
+                        "",
+                    ]
+                )
+                for index in range(rng.randint(10, 80))
+            )
+            block = f"```{language}\n{body}\n```"
+        elif kind < 0.6:
+            block = "\n".join(f"- item {index} with some detail" for index in range(rng.randint(3, 12)))
+        else:
+            block = " ".join(["The quick brown fox jumps over the lazy dog."] * rng.randint(2, 10))
+        blocks.append(block)
+        size += len(block) + 2
+    return "\n\n".join(blocks)
+
+
+def build_corpus(size_mb: float, answer_kb: float, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    corpus: list[str] = []
+    total = 0
+    while total < target:
+        answer = synthetic_answer(rng, int(rng.uniform(0.25, 1.75) * answer_kb * 1024))
+        corpus.append(answer)
+        total += len(answer)
+    return corpus
+
+
+def synthetic_pairs(rng: random.Random, turns: int, answer_kb: float) -> list[tuple[str, str]]:
+    return [
+        (
+            f"Question {index}: how does step {rng.randint(1, 99)} work?",
+            synthetic_answer(rng, int(rng.uniform(0.25, 1.75) * answer_kb * 1024)),
+        )
+        for index in range(turns)
+    ]
+
+
+def mapping_record(pairs: list[tuple[str, str]], fragments: bool) -> dict[str, Any]:
+    """Build a mapping tree: one DeepSeek node per pair, or ChatGPT user and assistant nodes."""
+    nodes: list[tuple[str, dict[str, Any]]] = []
+    for index, (question, answer) in enumerate(pairs, start=1):
+        if fragments:
+            message = {
+                "inserted_at": f"2024-01-01T00:{index // 60:02d}:{index % 60:02d}",
+                "fragments": [{"type": "REQUEST", "content": question}, {"type": "RESPONSE", "content": answer}],
+            }
+            nodes.append((str(index), message))
+            continue
+        nodes.append((f"u{index}", {"author": {"role": "user"}, "content": {"content_type": "text", "parts": [question]}}))
+        nodes.append((f"a{index}", {"author": {"role": "assistant"}, "content": {"content_type": "text", "parts": [answer]}}))
+
+    mapping: dict[str, Any] = {"root": {"id": "root", "parent": None, "children": [nodes[0][0]] if nodes else []}}
+    for position, (node_id, message) in enumerate(nodes):
+        mapping[node_id] = {
+            "id": node_id,
+            "parent": nodes[position - 1][0] if position else "root",
+            "children": [nodes[position + 1][0]] if position + 1 < len(nodes) else [],
+            "message": message,
+        }
+    return {"mapping": mapping, "current_node": nodes[-1][0] if nodes else "root"}
+
+
+def history_record(pairs: list[tuple[str, str]]) -> dict[str, Any]:
+    messages: dict[str, Any] = {}
+    parent = None
+    for index, (question, answer) in enumerate(pairs, start=1):
+        for role, content in (("user", question), ("assistant", answer)):
+            message_id = f"{role[0]}{index}"
+            messages[message_id] = {
+                "id": message_id,
+                "parentId": parent,
+                "role": role,
+                "content": content,
+                "timestamp": index * 2 + (role == "assistant"),
+            }
+            parent = message_id
+    return {"chat": {"history": {"currentId": parent, "messages": messages}}}
+
+
+def synthetic_record(shape: str, rng: random.Random, index: int, turns: int, answer_kb: float) -> dict[str, Any]:
+    pairs = synthetic_pairs(rng, turns, answer_kb)
+    if shape in {"mapping", "fragments"}:
+        record = mapping_record(pairs, fragments=shape == "fragments")
+    elif shape == "messages":
+        record = {
+            "messages": [
+                {"role": role, "content": content}
+                for question, answer in pairs
+                for role, content in (("user", question), ("assistant", answer))
+            ]
+        }
+    elif shape == "chat-messages":
+        record = {
+            "chat_messages": [
+                {"sender": sender, "text": text, "content": [{"type": "text", "text": text}]}
+                for question, answer in pairs
+                for sender, text in (("human", question), ("assistant", answer))
+            ]
+        }
+    elif shape == "pairs":
+        record = {"dialog": [{"question": question, "answer": answer} for question, answer in pairs]}
+    elif shape == "history":
+        record = history_record(pairs)
+    else:
+        raise ValueError(f"Unknown export shape: {shape}")
+    # Repeat titles now and then so filename deduplication is exercised too.
+    return {"id": f"{shape}-{index}", "title": f"Conversation {index % 997}", **record}
+
+
+def synthetic_export(shape: str, conversations: int, turns: int, answer_kb: float, seed: int) -> Any:
+    rng = random.Random(seed)
+    records = [synthetic_record(shape, rng, index, turns, answer_kb) for index in range(conversations)]
+    if shape == "history":
+        return {"data": records}
+    return records
+
+
+def run_generate(args: argparse.Namespace) -> int:
+    data = synthetic_export(args.shape, args.conversations, args.turns, args.answer_kb, args.seed)
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    print(f"Wrote {args.conversations} {args.shape} conversations to {output} ({output.stat().st_size / 1e6:.1f} MB)")
+    return 0
+
+
+def peak_rss_mb() -> float | None:
+    """Peak RSS of the process so far; a running maximum, not the usage of the last stage."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def benchmark_shape(
+    shape: str, conversations: int, turns: int, answer_kb: float, seed: int, loader: str = "auto"
+) -> list[dict[str, Any]]:
+    """Run every stage once on a fresh synthetic export; executed in its own process."""
+    stages: list[dict[str, Any]] = []
+
+    def record(stage: str, started: float, count: int, megabytes: float) -> None:
+        seconds = max(time.perf_counter() - started, 1e-9)
+        stages.append(
+            {
+                "stage": stage,
+                "seconds": seconds,
+                "conversations_per_sec": count / seconds,
+                "mb_per_sec": megabytes / seconds,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+
+    with tempfile.TemporaryDirectory(prefix="conversation-bench-") as temp_dir:
+        input_path = Path(temp_dir) / f"{shape}.json"
+        input_path.write_text(
+            json.dumps(synthetic_export(shape, conversations, turns, answer_kb, seed), ensure_ascii=False),
+            encoding="utf-8",
+        )
+        input_mb = input_path.stat().st_size / (1024 * 1024)
+
+        started = time.perf_counter()
+        data, loader_name = load_json(input_path, loader)
+        record("load", started, conversations, input_mb)
+        stages[-1]["loader"] = loader_name
+
+        started = time.perf_counter()
+        normalized = normalize_root(data, input_path.stem)
+        del data
+        record("normalize", started, len(normalized), input_mb)
+
+        started = time.perf_counter()
+        rendered = [
+            (conversation["title"], render_conversation(conversation["title"], conversation["turns"]))
+            for conversation in normalized
+        ]
+        del normalized
+        output_mb = sum(len(markdown.encode("utf-8")) for _, markdown in rendered) / (1024 * 1024)
+        record("render", started, len(rendered), output_mb)
+
+        output_dir = Path(temp_dir) / "out"
+        output_dir.mkdir()
+        started = time.perf_counter()
+        name_counter: defaultdict[str, int] = defaultdict(int)
+        for title, markdown in rendered:
+            (output_dir / unique_filename(title, name_counter)).write_text(markdown, encoding="utf-8")
+        record("write", started, len(rendered), output_mb)
+    return stages
+
+
+def run_pipeline(args: argparse.Namespace) -> int:
+    shapes = args.shape or list(EXPORT_SHAPES)
+    # ru_maxrss only grows, so each row shows the process peak up to the end of that stage.
+    print(f"{'shape':<14} {'stage':<10} {'seconds':>8} {'conv/s':>10} {'MB/s':>8} {'peak RSS so far MB':>19}")
+    loaders = set()
+    for shape in shapes:
+        # A fresh process per shape keeps peak RSS figures independent of earlier shapes.
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            stages = executor.submit(
+                benchmark_shape, shape, args.conversations, args.turns, args.answer_kb, args.seed, args.loader
+            ).result()
+        for stage in stages:
+            rss = stage["peak_rss_mb"]
+            loaders.add(stage.get("loader"))
+            print(
+                f"{shape:<14} {stage['stage']:<10} {stage['seconds']:8.2f} "
+                f"{stage['conversations_per_sec']:10.0f} {stage['mb_per_sec']:8.1f} "
+                f"{'n/a' if rss is None else f'{rss:.0f}':>19}"
+            )
+    print(f"Loader: {', '.join(sorted(name for name in loaders if name))}")
+    return 0
+
+
+def time_renderer(renderer: Callable[[str], str], corpus: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        for answer in corpus:
+            renderer(answer)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_render(args: argparse.Namespace) -> int:
+    corpus = build_corpus(args.size_mb, args.answer_kb, args.seed)
+    corpus_mb = sum(len(answer) for answer in corpus) / (1024 * 1024)
+    print(f"Corpus: {len(corpus)} answers, {corpus_mb:.1f} MB")
+
+    results = {
+        "legacy per-line re.match": time_renderer(legacy_demote_response_headings, corpus, args.repeat),
+        "demote_response_headings": time_renderer(demote_response_headings, corpus, args.repeat),
+    }
+    baseline = results["legacy per-line re.match"]
+    for name, seconds in results.items():
+        print(f"{name:<28} {seconds:8.2f}s {corpus_mb / seconds:8.1f} MB/s  x{baseline / seconds:.2f}")
+    return 0
+
+
+def main() -> int:
+    args = parse_args()
+    commands = {"render": run_render, "generate": run_generate, "pipeline": run_pipeline}
+    return commands[args.command](args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
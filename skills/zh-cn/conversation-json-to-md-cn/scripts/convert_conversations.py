@@ -4,15 +4,60 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import io
+import itertools
 import json
+import mmap
 import re
-from collections import defaultdict
+import tarfile
+import time
+import zipfile
+from collections import defaultdict, deque
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, TextIO
 
 
 Turn = tuple[str, str]
 Conversation = dict[str, Any]
+RecordMatcher = Callable[[dict[str, Any]], bool]
+RecordExtractor = Callable[[dict[str, Any], bool], list[Turn]]
+
+ROOT_LIST_KEYS = ("conversations", "data", "items", "chats", "sessions")
+TITLE_KEYS = ("title", "name", "subject", "topic")
+MESSAGE_LIST_SAMPLE_SIZE = 20
+STREAM_CHUNK_SIZE = 1 << 20
+RENDER_BATCH_SIZE = 64
+MANIFEST_NAME = ".conversion-manifest.json"
+# Bump when rendering changes so incremental runs rewrite every file once.
+MANIFEST_VERSION = 3
+CONVERSATION_ID_KEYS = ("id", "uuid", "conversation_id", "chat_id", "session_id")
+MESSAGE_LIST_KEYS = ("chat_messages", "messages", "turns", "dialog", "dialogue", "items")
+FORMAT_SAMPLE_SIZE = 5
+# Keys tried in order when flattening a dict; "parts" covers ChatGPT content objects.
+TEXT_VALUE_KEYS = ("text", "value", "content", "message", "output", "answer", "prompt", "question", "parts")
+# Dicts without a text field are dumped as JSON; larger dumps are truncated to this many characters.
+OPAQUE_JSON_MAX_CHARS = 20_000
+# Output formats: a plain directory of files, one archive, or one concatenated bundle.
+# The Markdown bundle uses a suffix that conversation filenames never get (see unique_filename).
+BUNDLE_MD_SUFFIX = ".bundle.md"
+OUTPUT_FORMATS = {"dir": "", "zip": ".zip", "tar": ".tar", "jsonl": ".jsonl", "md": BUNDLE_MD_SUFFIX}
+# Pending writes per I/O thread before the directory backend blocks the producer.
+WRITE_BEHIND_DEPTH = 8
+# Optional fast JSON backends, tried in this order by `--loader auto`.
+FAST_JSON_LOADERS = ("orjson", "msgspec")
+
+
+def positive_int(raw: str) -> int:
+    value = int(raw)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return value
 
 
 def parse_args() -> argparse.Namespace:
@@ -24,45 +69,158 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--input", required=True, help="Path to user-provided JSON file")
     parser.add_argument("--output-dir", required=True, help="Directory to write markdown files")
-    parser.add_argument(
+    write_mode = parser.add_mutually_exclusive_group()
+    write_mode.add_argument(
         "--clean",
         action="store_true",
-        help="Remove existing *.md files in output directory before writing",
+        help=f"Remove existing *.md files in output directory before writing (except *{BUNDLE_MD_SUFFIX} bundles)",
+    )
+    write_mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            f"Keep a {MANIFEST_NAME} of conversation ids and content hashes in the output directory; "
+            "skip unchanged conversations and remove files of conversations no longer in the export"
+        ),
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Parse the input incrementally and write each conversation as soon as it is read, "
+            "so peak memory is bounded by the largest single conversation"
+        ),
+    )
+    parser.add_argument(
+        "--current-branch",
+        action="store_true",
+        help=(
+            "For mapping-tree exports with a current_node, export only the branch leading to it "
+            "and skip regenerated or edited alternates"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=1,
+        help="Render conversations in N worker processes; output is identical to a serial run (default: 1)",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--loader",
+        choices=("auto", *FAST_JSON_LOADERS, "json"),
+        default="auto",
+        help=(
+            "JSON backend for non-streaming runs: auto uses orjson or msgspec over an mmap of the file "
+            "when installed and falls back to the standard library json module (default: auto)"
+        ),
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=tuple(OUTPUT_FORMATS),
+        default="dir",
+        help=(
+            "dir writes one .md file per conversation; zip/tar write them into a single archive; "
+            "jsonl/md write one concatenated bundle. Archives and bundles are named after the input "
+            f"file and placed in --output-dir; the md bundle is <input>{BUNDLE_MD_SUFFIX} (default: dir)"
+        ),
+    )
+    parser.add_argument(
+        "--io-threads",
+        type=positive_int,
+        default=4,
+        help="Threads that write files behind rendering for --output-format dir (default: 4)",
+    )
+    args = parser.parse_args()
+    if args.incremental and args.output_format != "dir":
+        parser.error("--incremental requires --output-format dir")
+    if args.stream and args.loader != "auto":
+        parser.error("--loader applies to whole-file parsing and cannot be combined with --stream")
+    return args
 
 
-def to_text(value: Any) -> str:
+TextCache = dict[int, tuple[Any, str]]
+TextSteps = Generator[Any, str, str]
+
+
+def scalar_text(value: Any) -> str | None:
+    """Return the text of a leaf value, or None for lists and dicts."""
     if value is None:
         return ""
     if isinstance(value, str):
         return value
     if isinstance(value, (int, float, bool)):
         return str(value)
+    if isinstance(value, (list, dict)):
+        return None
+    return opaque_json_text(value)
+
+
+def opaque_json_text(value: Any, max_chars: int = OPAQUE_JSON_MAX_CHARS) -> str:
+    """Pretty-print a value with no recognizable text field, truncated after `max_chars`."""
+    chunks: list[str] = []
+    size = 0
+    try:
+        for chunk in json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(value):
+            chunks.append(chunk)
+            size += len(chunk)
+            if max_chars and size > max_chars:
+                text = "".join(chunks)[:max_chars].rstrip()
+                return f"{text}\n... (truncated: JSON value exceeds {max_chars} characters)"
+    except RecursionError:
+        text = "".join(chunks)[:max_chars].rstrip() if max_chars else "".join(chunks)
+        return f"{text}\n... (truncated: JSON value is nested too deeply)"
+    return "".join(chunks)
+
+
+def text_steps(value: list[Any] | dict[str, Any]) -> TextSteps:
+    """Yield the child values a list or dict needs; each `send` returns the child's text."""
     if isinstance(value, list):
-        parts = [to_text(item).strip() for item in value]
-        parts = [part for part in parts if part]
+        parts: list[str] = []
+        for item in value:
+            text = (yield item).strip()
+            if text:
+                parts.append(text)
         return "\n".join(parts)
-    if isinstance(value, dict):
-        for key in (
-            "text",
-            "value",
-            "content",
-            "message",
-            "output",
-            "answer",
-            "prompt",
-            "question",
-        ):
-            if key in value:
-                text = to_text(value.get(key)).strip()
-                if text:
-                    return text
-        if "parts" in value:
-            text = to_text(value.get("parts")).strip()
+    for key in TEXT_VALUE_KEYS:
+        if key in value:
+            text = (yield value.get(key)).strip()
             if text:
                 return text
-    return json.dumps(value, ensure_ascii=False, indent=2)
+    return opaque_json_text(value)
+
+
+def to_text(value: Any, cache: TextCache | None = None) -> str:
+    """Flatten a content value to text without recursion.
+
+    `cache` maps `id()` of already flattened lists and dicts to their text, so callers that
+    probe the same message several times stringify each sub-tree at most once.
+    """
+    text = scalar_text(value)
+    if text is not None:
+        return text
+    if cache is not None and id(value) in cache:
+        return cache[id(value)][1]
+
+    stack: list[tuple[Any, TextSteps]] = [(value, text_steps(value))]
+    sent: str | None = None
+    while stack:
+        node, steps = stack[-1]
+        try:
+            child = steps.send(sent)  # type: ignore[arg-type]
+        except StopIteration as finished:
+            stack.pop()
+            sent = finished.value
+            if cache is not None:
+                cache[id(node)] = (node, sent)
+            continue
+        sent = scalar_text(child)
+        if sent is not None:
+            continue
+        if cache is not None and id(child) in cache:
+            sent = cache[id(child)][1]
+            continue
+        stack.append((child, text_steps(child)))
+    return sent or ""
 
 
 def clean_filename(raw: str, max_len: int = 120) -> str:
@@ -78,27 +236,46 @@ def question_heading(raw: str) -> str:
     return single_line or "（空问题）"
 
 
+# Lines that can change the demotion state: fence openers and ATX headings.
+# `[^\S\n]` is `\s` without the newline, so each match stays on one line.
+BLOCK_LINE_RE = re.compile(r"^[^\S\n]*(?:(?P<fence>`{3,}|~{3,})|(?P<hashes>#{1,6})(?=[^\S\n]))", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def closing_fence_re(fence: str) -> re.Pattern[str]:
+    """Match a bare closing fence: the opening character, at least as many times."""
+    char = re.escape(fence[0])
+    return re.compile(rf"^[^\S\n]*{char}{{{len(fence)},}}[^\S\n]*$", re.MULTILINE)
+
+
 def demote_response_headings(markdown: str) -> str:
-    """Demote headings by one level while preserving fenced code blocks."""
-    lines = markdown.splitlines()
-    result: list[str] = []
-    in_code_block = False
-    for line in lines:
-        if re.match(r"^\s*```", line):
-            in_code_block = not in_code_block
-            result.append(line)
-            continue
-        if in_code_block:
-            result.append(line)
+    """Demote headings by one level while preserving fenced code blocks.
+
+    A fence opened with N backticks or tildes is closed only by a bare fence of the same
+    character that is at least N long, so shorter or mixed fences inside a block stay literal.
+    Fenced blocks are skipped with a single search for their closing fence.
+    """
+    text = "\n".join(markdown.splitlines())
+    parts: list[str] = []
+    last = 0
+    pos = 0
+    while match := BLOCK_LINE_RE.search(text, pos):
+        fence = match.group("fence")
+        if fence:
+            closing = closing_fence_re(fence).search(text, match.end())
+            if closing is None:
+                break
+            pos = closing.end()
             continue
-        match = re.match(r"^(\s*)(#{1,6})(\s+.*)$", line)
-        if not match:
-            result.append(line)
+        pos = match.end()
+        if len(match.group("hashes")) == 6:
             continue
-        indent, hashes, rest = match.groups()
-        level = min(6, len(hashes) + 1)
-        result.append(f"{indent}{'#' * level}{rest}")
-    return "\n".join(result).strip()
+        start = match.start("hashes")
+        parts.append(text[last:start])
+        parts.append("#")
+        last = start
+    parts.append(text[last:])
+    return "".join(parts).strip()
 
 
 def normalize_role(raw: Any) -> str | None:
@@ -152,7 +329,9 @@ def extract_role_from_message(message: dict[str, Any]) -> str | None:
     return None
 
 
-def extract_content_from_content_list(content_list: Any, role: str | None) -> str:
+def extract_content_from_content_list(
+    content_list: Any, role: str | None, cache: TextCache | None = None
+) -> str:
     if not isinstance(content_list, list):
         return ""
 
@@ -172,12 +351,12 @@ def extract_content_from_content_list(content_list: Any, role: str | None) -> st
             for key in ("content", "text", "value", "message", "output", "answer"):
                 if key not in item:
                     continue
-                candidate = to_text(item.get(key)).strip()
+                candidate = to_text(item.get(key), cache).strip()
                 if candidate:
                     text = candidate
                     break
         else:
-            text = to_text(item).strip()
+            text = to_text(item, cache).strip()
 
         if not text:
             continue
@@ -241,34 +420,38 @@ def extract_text_from_content_blocks(blocks: Any, role: str | None) -> str:
     return "\n\n".join(fallback).strip()
 
 
-def extract_content_from_message(message: dict[str, Any], role: str | None) -> str:
+def extract_content_from_message(
+    message: dict[str, Any], role: str | None, cache: TextCache | None = None
+) -> str:
+    if cache is None:
+        cache = {}
     content_value = message.get("content")
     if isinstance(content_value, list):
         text = extract_text_from_content_blocks(content_value, role).strip()
         if text:
             return text
     elif content_value is not None:
-        text = to_text(content_value).strip()
+        text = to_text(content_value, cache).strip()
         if text:
             return text
 
     for key in ("text", "value", "message", "output", "answer", "prompt", "question"):
         if key in message:
-            text = to_text(message.get(key)).strip()
+            text = to_text(message.get(key), cache).strip()
             if text:
                 return text
     if "content_list" in message:
-        text = extract_content_from_content_list(message.get("content_list"), role).strip()
+        text = extract_content_from_content_list(message.get("content_list"), role, cache).strip()
         if text:
             return text
     if role == "assistant":
-        text = to_text(message.get("reasoning_content")).strip()
+        text = to_text(message.get("reasoning_content"), cache).strip()
         if text:
             return text
     return ""
 
 
-def extract_pair_turns(entry: dict[str, Any]) -> list[Turn]:
+def extract_pair_turns(entry: dict[str, Any], cache: TextCache | None = None) -> list[Turn]:
     pair_keys = [
         ("question", "answer"),
         ("prompt", "response"),
@@ -278,8 +461,8 @@ def extract_pair_turns(entry: dict[str, Any]) -> list[Turn]:
     ]
     for left_key, right_key in pair_keys:
         if left_key in entry and right_key in entry:
-            left = to_text(entry.get(left_key)).strip()
-            right = to_text(entry.get(right_key)).strip()
+            left = to_text(entry.get(left_key), cache).strip()
+            right = to_text(entry.get(right_key), cache).strip()
             turns: list[Turn] = []
             if left:
                 turns.append(("user", left))
@@ -314,12 +497,14 @@ def turns_from_message(message: Any) -> list[Turn]:
             if turns:
                 return turns
 
-        paired = extract_pair_turns(message)
+        # Pair detection and content extraction probe overlapping keys; share one text cache.
+        cache: TextCache = {}
+        paired = extract_pair_turns(message, cache)
         if paired:
             return paired
 
         role = extract_role_from_message(message)
-        content = extract_content_from_message(message, role)
+        content = extract_content_from_message(message, role, cache)
         if role in {"user", "assistant"} and content:
             return [(role, content)]
     elif isinstance(message, (list, tuple)) and len(message) >= 2:
@@ -351,55 +536,77 @@ def looks_like_message(entry: Any) -> bool:
 def looks_like_message_list(items: Any) -> bool:
     if not isinstance(items, list) or not items:
         return False
-    sample = [item for item in items[:20] if item is not None]
+    sample = [item for item in items[:MESSAGE_LIST_SAMPLE_SIZE] if item is not None]
     if not sample:
         return False
     matched = sum(1 for item in sample if looks_like_message(item))
     return matched >= max(1, len(sample) // 2)
 
 
+NUMERIC_NODE_ID_RE = re.compile(r"\s*[+-]?\d+\s*")
+
+
 def node_sort_key(node_id: str, node: dict[str, Any]) -> tuple[Any, ...]:
     message = (node or {}).get("message") or {}
     inserted_at = message.get("inserted_at")
-    try:
-        numeric_id = int(str(node_id))
-    except Exception:
-        numeric_id = 10**9
-    return (inserted_at is None, inserted_at or "", numeric_id, str(node_id))
+    node_id = str(node_id)
+    numeric_id = int(node_id) if NUMERIC_NODE_ID_RE.fullmatch(node_id) else 10**9
+    return (inserted_at is None, inserted_at or "", numeric_id, node_id)
 
 
 def ordered_node_ids(mapping: dict[str, Any]) -> list[str]:
-    root = mapping.get("root") or {}
+    """Return mapping node ids in depth-first pre-order from `root`, then orphan subtrees.
+
+    Uses an explicit stack so very deep trees cannot hit the recursion limit.
+    """
     visited: set[str] = set()
     order: list[str] = []
 
-    def dfs(node_id: str) -> None:
-        if node_id in visited:
-            return
-        visited.add(node_id)
-        if node_id != "root" and node_id in mapping:
-            order.append(node_id)
-        node = mapping.get(node_id) or {}
-        for child in node.get("children") or []:
-            dfs(str(child))
+    def walk(start_ids: Iterable[Any]) -> None:
+        stack = [str(node_id) for node_id in start_ids]
+        stack.reverse()
+        while stack:
+            node_id = stack.pop()
+            if node_id in visited:
+                continue
+            visited.add(node_id)
+            if node_id != "root" and node_id in mapping:
+                order.append(node_id)
+            children = (mapping.get(node_id) or {}).get("children") or []
+            stack.extend(str(child) for child in reversed(children))
 
-    for child in root.get("children") or []:
-        dfs(str(child))
+    walk((mapping.get("root") or {}).get("children") or [])
 
     remaining = [
-        (node_id, node)
+        (node_sort_key(node_id, node), node_id)
         for node_id, node in mapping.items()
         if node_id not in visited and node_id != "root"
     ]
-    for node_id, _ in sorted(remaining, key=lambda item: node_sort_key(item[0], item[1])):
-        dfs(str(node_id))
+    remaining.sort()
+    walk(node_id for _, node_id in remaining)
 
     return order
 
 
-def extract_turns_from_mapping(mapping: dict[str, Any]) -> list[Turn]:
+def current_branch_node_ids(mapping: dict[str, Any], current_node: Any) -> list[str]:
+    """Return node ids from the root down to `current_node` by following `parent` links."""
+    chain: list[str] = []
+    seen: set[str] = set()
+    cursor = None if current_node is None else str(current_node)
+    while cursor is not None and cursor not in seen and cursor in mapping:
+        seen.add(cursor)
+        if cursor != "root":
+            chain.append(cursor)
+        parent = (mapping.get(cursor) or {}).get("parent")
+        cursor = None if parent in (None, "") else str(parent)
+    chain.reverse()
+    return chain
+
+
+def extract_turns_from_mapping(mapping: dict[str, Any], current_node: Any = None) -> list[Turn]:
+    node_ids = current_branch_node_ids(mapping, current_node) if current_node is not None else []
     turns: list[Turn] = []
-    for node_id in ordered_node_ids(mapping):
+    for node_id in node_ids or ordered_node_ids(mapping):
         node = mapping.get(node_id) or {}
         message = node.get("message")
         turns.extend(turns_from_message(message))
@@ -488,22 +695,32 @@ def extract_turns_from_chat_container(chat_value: Any) -> list[Turn]:
 
 
 def choose_title(obj: dict[str, Any], fallback: str) -> str:
-    for key in ("title", "name", "subject", "topic"):
+    for key in TITLE_KEYS:
         value = obj.get(key)
         if isinstance(value, str) and value.strip():
             return value.strip()
     return fallback
 
 
-def extract_turns_from_conversation_object(obj: dict[str, Any], fallback_title: str) -> Conversation:
+def choose_conversation_id(obj: dict[str, Any]) -> str | None:
+    for key in CONVERSATION_ID_KEYS:
+        value = obj.get(key)
+        if isinstance(value, (str, int)) and not isinstance(value, bool) and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def extract_turns_from_conversation_object(
+    obj: dict[str, Any], fallback_title: str, current_branch: bool = False
+) -> Conversation:
     title = choose_title(obj, fallback_title)
     turns: list[Turn] = []
 
     mapping = obj.get("mapping")
     if isinstance(mapping, dict):
-        turns.extend(extract_turns_from_mapping(mapping))
+        turns.extend(extract_turns_from_mapping(mapping, obj.get("current_node") if current_branch else None))
 
-    for key in ("chat_messages", "messages", "turns", "dialog", "dialogue", "items"):
+    for key in MESSAGE_LIST_KEYS:
         value = obj.get(key)
         if isinstance(value, list) and looks_like_message_list(value):
             turns.extend(extract_turns_from_message_list(value))
@@ -526,55 +743,373 @@ def extract_turns_from_conversation_object(obj: dict[str, Any], fallback_title:
     if not turns and isinstance(conversations_value, list) and looks_like_message_list(conversations_value):
         turns.extend(extract_turns_from_message_list(conversations_value))
 
-    return {"title": title, "turns": turns}
+    return {"title": title, "id": choose_conversation_id(obj), "turns": turns}
+
+
+def has_message_list_key(obj: dict[str, Any]) -> bool:
+    return any(isinstance(obj.get(key), list) for key in MESSAGE_LIST_KEYS)
+
+
+def is_mapping_record(obj: dict[str, Any]) -> bool:
+    return isinstance(obj.get("mapping"), dict) and not has_message_list_key(obj)
+
+
+def mapping_has_fragments(mapping: dict[str, Any], probe: int = 3) -> bool:
+    probed = 0
+    for node in mapping.values():
+        message = node.get("message") if isinstance(node, dict) else None
+        if not isinstance(message, dict):
+            continue
+        if isinstance(message.get("fragments"), list):
+            return True
+        probed += 1
+        if probed >= probe:
+            break
+    return False
+
+
+def is_fragments_record(obj: dict[str, Any]) -> bool:
+    return is_mapping_record(obj) and mapping_has_fragments(obj["mapping"])
+
+
+def is_chat_messages_record(obj: dict[str, Any]) -> bool:
+    messages = obj.get("chat_messages")
+    if "mapping" in obj or not isinstance(messages, list) or not messages:
+        return False
+    first = messages[0]
+    # The generic path only reads `chat_messages` when the list looks like messages; require the same here.
+    return isinstance(first, dict) and "sender" in first and looks_like_message_list(messages)
+
+
+def open_webui_history(obj: dict[str, Any]) -> dict[str, Any] | None:
+    if "mapping" in obj or has_message_list_key(obj):
+        return None
+    history = obj.get("history")
+    if history is None:
+        chat = obj.get("chat")
+        if not isinstance(chat, dict) or isinstance(chat.get("messages"), list):
+            return None
+        history = chat.get("history")
+    if not isinstance(history, dict) or not isinstance(history.get("messages"), dict):
+        return None
+    return history if isinstance(history.get("currentId"), str) else None
+
 
+def is_history_record(obj: dict[str, Any]) -> bool:
+    return open_webui_history(obj) is not None
 
-def normalize_root(data: Any, input_stem: str) -> list[Conversation]:
-    conversations: list[Conversation] = []
 
+def extract_turns_from_fragment_mapping(mapping: dict[str, Any], current_node: Any = None) -> list[Turn]:
+    node_ids = current_branch_node_ids(mapping, current_node) if current_node is not None else []
+    turns: list[Turn] = []
+    for node_id in node_ids or ordered_node_ids(mapping):
+        message = (mapping.get(node_id) or {}).get("message")
+        fragments = message.get("fragments") if isinstance(message, dict) else None
+        fragment_turns = turns_from_fragments(fragments) if isinstance(fragments, list) else []
+        turns.extend(fragment_turns or turns_from_message(message))
+    return turns
+
+
+# Record formats checked by `FormatDetector`, most specific first. Each matcher is a cheap
+# structural check; each extractor must return what `extract_turns_from_conversation_object`
+# would for a matching record, or no turns to request the generic fallback.
+RECORD_FORMATS: dict[str, tuple[RecordMatcher, RecordExtractor]] = {
+    "deepseek-fragments": (
+        is_fragments_record,
+        lambda obj, current_branch: extract_turns_from_fragment_mapping(
+            obj["mapping"], obj.get("current_node") if current_branch else None
+        ),
+    ),
+    "chatgpt-mapping": (
+        is_mapping_record,
+        lambda obj, current_branch: extract_turns_from_mapping(
+            obj["mapping"], obj.get("current_node") if current_branch else None
+        ),
+    ),
+    "claude-chat-messages": (
+        is_chat_messages_record,
+        lambda obj, current_branch: extract_turns_from_message_list(obj["chat_messages"]),
+    ),
+    "open-webui-history": (
+        is_history_record,
+        lambda obj, current_branch: extract_turns_from_history(open_webui_history(obj)),
+    ),
+}
+
+
+def fingerprint_record(obj: dict[str, Any]) -> str | None:
+    for name, (matches, _) in RECORD_FORMATS.items():
+        if matches(obj):
+            return name
+    return None
+
+
+class FormatDetector:
+    """Fingerprint the first records of an export and fast-path the rest through one extractor.
+
+    Exports are usually homogeneous, so the format is decided once from the first
+    `sample_size` records. Later records only run that format's matcher; a record that
+    fails it, or yields no turns, goes through the generic probing instead.
+    """
+
+    def __init__(self, sample_size: int = FORMAT_SAMPLE_SIZE, current_branch: bool = False) -> None:
+        self.sample_size = sample_size
+        self.current_branch = current_branch
+        self.sampled: list[str | None] = []
+        self.format: str | None = None
+
+    @property
+    def decided(self) -> bool:
+        return len(self.sampled) >= self.sample_size
+
+    def record_format(self, obj: dict[str, Any]) -> str | None:
+        if not self.decided:
+            name = fingerprint_record(obj)
+            self.sampled.append(name)
+            if self.decided and len(set(self.sampled)) == 1:
+                self.format = name
+            return name
+        if self.format and RECORD_FORMATS[self.format][0](obj):
+            return self.format
+        return None
+
+    def extract(self, obj: dict[str, Any], fallback_title: str) -> Conversation:
+        name = self.record_format(obj)
+        if name:
+            turns = RECORD_FORMATS[name][1](obj, self.current_branch)
+            if turns:
+                return {"title": choose_title(obj, fallback_title), "id": choose_conversation_id(obj), "turns": turns}
+        return extract_turns_from_conversation_object(obj, fallback_title, self.current_branch)
+
+
+def conversation_from_item(item: Any, fallback_title: str, detector: FormatDetector) -> Conversation | None:
+    if isinstance(item, dict):
+        return detector.extract(item, fallback_title)
+    if isinstance(item, list) and looks_like_message_list(item):
+        return {"title": fallback_title, "turns": extract_turns_from_message_list(item)}
+    return None
+
+
+def iter_list_conversations(
+    items: Iterable[Any], input_stem: str, list_title: str, current_branch: bool = False
+) -> Iterator[Conversation]:
+    """Yield conversations from a list of records, consuming `items` lazily.
+
+    A list whose leading items look like messages is one conversation titled `list_title`;
+    otherwise every item is a conversation object or a nested message list.
+    """
+    iterator = iter(items)
+    head = list(itertools.islice(iterator, MESSAGE_LIST_SAMPLE_SIZE))
+    if looks_like_message_list(head):
+        messages = head + list(iterator)
+        yield {"title": list_title, "turns": extract_turns_from_message_list(messages)}
+        return
+    detector = FormatDetector(current_branch=current_branch)
+    for index, item in enumerate(itertools.chain(head, iterator), start=1):
+        conversation = conversation_from_item(item, f"{input_stem}-{index}", detector)
+        if conversation is not None:
+            yield conversation
+
+
+def normalize_root(data: Any, input_stem: str, current_branch: bool = False) -> list[Conversation]:
     if isinstance(data, list):
-        if looks_like_message_list(data):
-            return [{"title": input_stem, "turns": extract_turns_from_message_list(data)}]
-        for index, item in enumerate(data, start=1):
-            fallback_title = f"{input_stem}-{index}"
-            if isinstance(item, dict):
-                conversations.append(extract_turns_from_conversation_object(item, fallback_title))
-            elif isinstance(item, list) and looks_like_message_list(item):
-                conversations.append({"title": fallback_title, "turns": extract_turns_from_message_list(item)})
-        return conversations
+        return list(iter_list_conversations(data, input_stem, input_stem, current_branch))
 
     if isinstance(data, dict):
-        for key in ("conversations", "data", "items", "chats", "sessions"):
+        for key in ROOT_LIST_KEYS:
             value = data.get(key)
             if not isinstance(value, list):
                 continue
-            if looks_like_message_list(value):
-                title = choose_title(data, input_stem)
-                return [{"title": title, "turns": extract_turns_from_message_list(value)}]
-
-            nested: list[Conversation] = []
-            for index, item in enumerate(value, start=1):
-                fallback_title = f"{input_stem}-{index}"
-                if isinstance(item, dict):
-                    nested.append(extract_turns_from_conversation_object(item, fallback_title))
-                elif isinstance(item, list) and looks_like_message_list(item):
-                    nested.append(
-                        {
-                            "title": fallback_title,
-                            "turns": extract_turns_from_message_list(item),
-                        }
-                    )
+            nested = list(
+                iter_list_conversations(value, input_stem, choose_title(data, input_stem), current_branch)
+            )
             if nested:
                 return nested
 
-        single = extract_turns_from_conversation_object(data, input_stem)
+        single = extract_turns_from_conversation_object(data, input_stem, current_branch)
         if single.get("turns"):
             return [single]
 
         if looks_like_message(data):
             return [{"title": input_stem, "turns": extract_turns_from_message_list([data])}]
 
-    return conversations
+    return []
+
+
+class JsonStream:
+    """Incremental JSON reader that decodes one value at a time from a text handle."""
+
+    _whitespace = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, handle: TextIO, chunk_size: int = STREAM_CHUNK_SIZE) -> None:
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        if self.pos:
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+        chunk = self.handle.read(max(size, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ("" at end of input)."""
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Malformed JSON stream: expected {char!r}, found {found or 'end of input'!r}")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Grow reads geometrically so one large value is re-scanned O(log n) times.
+                self._fill(read_size)
+                read_size *= 2
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # A number at the buffer edge may continue in the next chunk.
+                self._fill(read_size)
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self) -> None:
+        """Consume one value, decoding an array or object one member at a time and discarding it."""
+        first = self.peek()
+        if first == "[":
+            for _ in self.iter_array():
+                pass
+        elif first == "{":
+            for _ in self.iter_object_keys():
+                self.decode_value()
+        else:
+            self.decode_value()
+
+    def _next_separator(self, closing: str) -> bool:
+        separator = self.peek()
+        if separator == closing:
+            self.pos += 1
+            return False
+        self.expect(",")
+        return True
+
+    def iter_array(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if not self._next_separator("]"):
+                return
+
+    def iter_object_keys(self) -> Iterator[str]:
+        """Yield object keys; the caller must consume each value before advancing."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            yield key
+            if not self._next_separator("}"):
+                return
+
+
+def scan_root_object(stream: JsonStream) -> tuple[dict[str, Any], dict[str, int]]:
+    """Read the keys of a top-level object, decoding only the title fields.
+
+    Returns the title fields and, for every conversation-list key whose value is an array,
+    which occurrence of that key holds it. As with `json.load`, a repeated key keeps its last value.
+    """
+    titles: dict[str, Any] = {}
+    lists: dict[str, int] = {}
+    occurrences: defaultdict[str, int] = defaultdict(int)
+    for key in stream.iter_object_keys():
+        occurrence = occurrences[key]
+        occurrences[key] += 1
+        if key in TITLE_KEYS:
+            titles[key] = stream.decode_value()
+            continue
+        if key in ROOT_LIST_KEYS:
+            if stream.peek() == "[":
+                lists[key] = occurrence
+            else:
+                lists.pop(key, None)
+        stream.skip_value()
+    return titles, lists
+
+
+def iter_root_list(stream: JsonStream, key: str, occurrence: int) -> Iterator[Any]:
+    """Skip to the given occurrence of a top-level key and yield the items of its array."""
+    seen = 0
+    for name in stream.iter_object_keys():
+        if name == key:
+            if seen == occurrence:
+                yield from stream.iter_array()
+                return
+            seen += 1
+        stream.skip_value()
+
+
+def iter_streamed_conversations(
+    handle: TextIO, input_stem: str, current_branch: bool = False
+) -> Iterator[Conversation]:
+    """Stream conversations from the top-level array or a top-level conversation list.
+
+    For a top-level object, a first pass over its keys finds the conversation lists and the title,
+    then the lists are streamed in `ROOT_LIST_KEYS` order until one yields conversations, so the
+    chosen list and title match `normalize_root`. When none does, the whole document is decoded
+    and goes through `normalize_root`. `handle` must be seekable.
+    """
+    stream = JsonStream(handle)
+    first = stream.peek()
+    if first == "[":
+        yield from iter_list_conversations(stream.iter_array(), input_stem, input_stem, current_branch)
+        return
+    if first != "{":
+        yield from normalize_root(stream.decode_value(), input_stem, current_branch)
+        return
+
+    titles, lists = scan_root_object(stream)
+    list_title = choose_title(titles, input_stem)
+    for key in ROOT_LIST_KEYS:
+        if key not in lists:
+            continue
+        handle.seek(0)
+        produced = False
+        for conversation in iter_list_conversations(
+            iter_root_list(JsonStream(handle), key, lists[key]), input_stem, list_title, current_branch
+        ):
+            produced = True
+            yield conversation
+        if produced:
+            return
+    handle.seek(0)
+    yield from normalize_root(JsonStream(handle).decode_value(), input_stem, current_branch)
 
 
 def extract_qa_lines(turns: list[Turn]) -> list[str]:
@@ -602,6 +1137,350 @@ def extract_qa_lines(turns: list[Turn]) -> list[str]:
     return lines
 
 
+def render_conversation(raw_title: str, turns: list[Turn]) -> str:
+    qa_lines = extract_qa_lines(turns)
+    lines = [f"# {raw_title}", ""]
+    if qa_lines:
+        lines.extend(qa_lines)
+    else:
+        lines.append("（无可导出的问答内容）")
+        lines.append("")
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def has_qa_turns(turns: list[Turn]) -> bool:
+    """Return True when `extract_qa_lines` would emit at least one Q/A line."""
+    return any(role in {"user", "assistant"} and content.strip() for role, content in turns)
+
+
+def conversation_digest(raw_title: str, turns: list[Turn]) -> str:
+    digest = hashlib.sha256(raw_title.encode("utf-8"))
+    for role, content in turns:
+        digest.update(b"\0" + role.encode("utf-8") + b"\0" + content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+RenderTask = tuple[str, str, list[Turn]]
+Rendered = tuple[str, str]
+
+
+def render_batch(batch: list[RenderTask]) -> list[Rendered]:
+    return [(filename, render_conversation(raw_title, turns)) for filename, raw_title, turns in batch]
+
+
+def iter_rendered(tasks: Iterable[RenderTask], workers: int = 1) -> Iterator[Rendered]:
+    """Render `(filename, raw_title, turns)` tasks in order, optionally on a process pool.
+
+    Results are yielded in submission order and at most `2 * workers` batches are in flight,
+    so streamed input stays memory-bounded.
+    """
+    tasks = iter(tasks)
+    if workers <= 1:
+        for filename, raw_title, turns in tasks:
+            yield filename, render_conversation(raw_title, turns)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future[list[Rendered]]] = deque()
+        while batch := list(itertools.islice(tasks, RENDER_BATCH_SIZE)):
+            pending.append(executor.submit(render_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def unique_filename(raw_title: str, name_counter: defaultdict[str, int]) -> str:
+    base_name = clean_filename(raw_title)
+    reserved = BUNDLE_MD_SUFFIX[: -len(".md")]
+    if base_name.lower().endswith(reserved):
+        # Keep `*.bundle.md` free for the Markdown bundle so neither can overwrite the other.
+        base_name = f"{base_name[: -len(reserved)]} {reserved[1:]}"
+    name_counter[base_name] += 1
+    duplicate_index = name_counter[base_name]
+    return f"{base_name}.md" if duplicate_index == 1 else f"{base_name} ({duplicate_index}).md"
+
+
+def load_manifest(output_dir: Path) -> dict[str, dict[str, Any]]:
+    manifest_path = output_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    entries = manifest.get("conversations")
+    return entries if isinstance(entries, dict) else {}
+
+
+def save_manifest(output_dir: Path, entries: dict[str, dict[str, Any]]) -> None:
+    manifest_path = output_dir / MANIFEST_NAME
+    temp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    payload = {"version": MANIFEST_VERSION, "conversations": entries}
+    temp_path.write_text(json.dumps(payload, ensure_ascii=False, indent=1), encoding="utf-8")
+    temp_path.replace(manifest_path)
+
+
+class OutputBackend:
+    """Destination for rendered conversations; use as a context manager.
+
+    `flush()` returns once every accepted write is durable and re-raises the first write error.
+    Leaving the `with` block because of an exception discards partial archives and bundles.
+    """
+
+    location: Path
+
+    def __enter__(self) -> "OutputBackend":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        self.close(success=exc_type is None)
+
+    def write(self, filename: str, markdown: str) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self, success: bool = True) -> None:
+        pass
+
+
+class DirectoryBackend(OutputBackend):
+    """Write-behind backend: files are written by a thread pool while rendering continues."""
+
+    def __init__(self, output_dir: Path, io_threads: int = 4) -> None:
+        self.location = output_dir
+        self.io_threads = io_threads
+        self.executor = ThreadPoolExecutor(max_workers=io_threads) if io_threads > 1 else None
+        self.pending: deque[Future[Any]] = deque()
+
+    def write(self, filename: str, markdown: str) -> None:
+        path = self.location / filename
+        if self.executor is None:
+            path.write_text(markdown, encoding="utf-8")
+            return
+        while len(self.pending) >= self.io_threads * WRITE_BEHIND_DEPTH:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(path.write_text, markdown, encoding="utf-8"))
+
+    def flush(self) -> None:
+        while self.pending:
+            self.pending.popleft().result()
+
+    def close(self, success: bool = True) -> None:
+        try:
+            if success:
+                self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ArchiveBackend(OutputBackend):
+    """Write every conversation as a member of one `.zip` or `.tar` archive."""
+
+    def __init__(self, location: Path, kind: str) -> None:
+        self.location = location
+        self.temp_path = location.with_name(location.name + ".tmp")
+        self.kind = kind
+        self.mtime = time.time()
+        if kind == "zip":
+            self.archive: Any = zipfile.ZipFile(self.temp_path, "w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(self.temp_path, "w", format=tarfile.PAX_FORMAT)
+
+    def write(self, filename: str, markdown: str) -> None:
+        data = markdown.encode("utf-8")
+        if self.kind == "zip":
+            self.archive.writestr(filename, data)
+            return
+        member = tarfile.TarInfo(filename)
+        member.size = len(data)
+        member.mtime = int(self.mtime)
+        member.mode = 0o644
+        self.archive.addfile(member, io.BytesIO(data))
+
+    def close(self, success: bool = True) -> None:
+        self.archive.close()
+        if success:
+            self.temp_path.replace(self.location)
+        else:
+            self.temp_path.unlink(missing_ok=True)
+
+
+class BundleBackend(OutputBackend):
+    """Concatenate all conversations into one JSONL or Markdown file.
+
+    JSONL lines are `{"file": ..., "markdown": ...}`; the Markdown bundle separates
+    conversations with a `<!-- file: ... -->` marker line.
+    """
+
+    def __init__(self, location: Path, kind: str) -> None:
+        self.location = location
+        self.temp_path = location.with_name(location.name + ".tmp")
+        self.kind = kind
+        self.handle = self.temp_path.open("w", encoding="utf-8", newline="\n")
+        self.count = 0
+
+    def write(self, filename: str, markdown: str) -> None:
+        if self.kind == "jsonl":
+            self.handle.write(json.dumps({"file": filename, "markdown": markdown}, ensure_ascii=False) + "\n")
+        else:
+            if self.count:
+                self.handle.write("\n")
+            self.handle.write(f"<!-- file: {filename} -->\n\n{markdown}")
+        self.count += 1
+
+    def flush(self) -> None:
+        self.handle.flush()
+
+    def close(self, success: bool = True) -> None:
+        self.handle.close()
+        if success:
+            self.temp_path.replace(self.location)
+        else:
+            self.temp_path.unlink(missing_ok=True)
+
+
+def open_output_backend(output_format: str, output_dir: Path, input_stem: str, io_threads: int = 4) -> OutputBackend:
+    if output_format == "dir":
+        return DirectoryBackend(output_dir, io_threads)
+    location = output_dir / f"{input_stem}{OUTPUT_FORMATS[output_format]}"
+    if output_format in ("zip", "tar"):
+        return ArchiveBackend(location, output_format)
+    return BundleBackend(location, output_format)
+
+
+def write_conversations(
+    conversations: Iterable[Conversation],
+    output_dir: Path,
+    input_stem: str,
+    workers: int = 1,
+    incremental: bool = False,
+    backend: OutputBackend | None = None,
+) -> dict[str, int]:
+    """Write one Markdown document per conversation and return the run counters.
+
+    Filenames are assigned here, in input order, before any rendering happens. In incremental
+    mode a conversation whose stable id, filename and content hash match the manifest is skipped,
+    and files of conversations that disappeared from the export are removed. Without a `backend`,
+    files are written directly into `output_dir`; incremental mode only supports directories.
+    """
+    if backend is None:
+        with DirectoryBackend(output_dir, io_threads=1) as directory:
+            return write_conversations(conversations, output_dir, input_stem, workers, incremental, directory)
+    writes_directory = isinstance(backend, DirectoryBackend)
+    if incremental and not writes_directory:
+        raise ValueError("Incremental conversion requires a directory output backend")
+
+    name_counter: defaultdict[str, int] = defaultdict(int)
+    previous = load_manifest(output_dir) if incremental else {}
+    current: dict[str, dict[str, Any]] = {}
+    stats = {"detected": 0, "written": 0, "with_qa": 0, "skipped": 0, "removed": 0}
+
+    def tasks() -> Iterator[RenderTask]:
+        for index, conversation in enumerate(conversations, start=1):
+            raw_title = (conversation.get("title") or "").strip() or f"{input_stem}-{index}"
+            turns = conversation.get("turns") or []
+            filename = unique_filename(raw_title, name_counter)
+            stats["detected"] += 1
+            if has_qa_turns(turns):
+                stats["with_qa"] += 1
+            if not incremental:
+                yield filename, raw_title, turns
+                continue
+
+            key = str(conversation.get("id") or filename)
+            if key in current:
+                key = f"{key}#{filename}"
+            entry = {"file": filename, "hash": conversation_digest(raw_title, turns)}
+            current[key] = entry
+            if previous.get(key) == entry and (output_dir / filename).exists():
+                stats["skipped"] += 1
+                continue
+            yield filename, raw_title, turns
+
+    for filename, markdown in iter_rendered(tasks(), workers):
+        backend.write(filename, markdown)
+        stats["written"] += 1
+    backend.flush()
+
+    if incremental:
+        live_files = {entry["file"] for entry in current.values()}
+        for entry in previous.values():
+            filename = entry.get("file") if isinstance(entry, dict) else None
+            if not filename or filename in live_files:
+                continue
+            stale_path = output_dir / filename
+            if stale_path.parent == output_dir and stale_path.exists():
+                stale_path.unlink()
+                stats["removed"] += 1
+        save_manifest(output_dir, current)
+    elif writes_directory:
+        (output_dir / MANIFEST_NAME).unlink(missing_ok=True)
+
+    return stats
+
+
+def decode_json_bytes(data: Any, loader: str) -> Any:
+    if loader == "orjson":
+        import orjson
+
+        return orjson.loads(data)
+    if loader == "msgspec":
+        import msgspec
+
+        return msgspec.json.decode(data)
+    raise ValueError(f"Unknown JSON loader: {loader}")
+
+
+def load_json(input_path: Path, loader: str = "auto") -> tuple[Any, str]:
+    """Parse the whole input file and return `(data, backend description)`.
+
+    Fast backends decode straight from a read-only mmap of the file, avoiding a text copy.
+    With `auto`, a document a fast backend rejects (for example NaN or integers beyond
+    64 bits) is parsed again with the standard library.
+    """
+    candidates = [loader] if loader != "auto" else [
+        name for name in FAST_JSON_LOADERS if importlib.util.find_spec(name) is not None
+    ]
+    for name in candidates:
+        if name == "json":
+            break
+        if importlib.util.find_spec(name) is None:
+            raise ImportError(f"JSON loader '{name}' is not installed; run `pip install {name}` or use --loader json")
+        try:
+            with input_path.open("rb") as handle:
+                if input_path.stat().st_size == 0:
+                    return decode_json_bytes(b"", name), name
+                with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    return decode_json_bytes(view, name), f"{name} (mmap)"
+        except Exception:
+            if loader != "auto":
+                raise
+
+    with input_path.open("r", encoding="utf-8") as handle:
+        return json.load(handle), "json"
+
+
+def timed_iter(items: Iterable[Any], timings: dict[str, float], stage: str) -> Iterator[Any]:
+    """Yield from `items`, adding the time spent producing each item to `timings[stage]`."""
+    iterator = iter(items)
+    timings.setdefault(stage, 0.0)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[stage] += time.perf_counter() - started
+            return
+        timings[stage] += time.perf_counter() - started
+        yield item
+
+
 def main() -> int:
     args = parse_args()
     input_path = Path(args.input)
@@ -610,49 +1489,65 @@ def main() -> int:
     if not input_path.exists():
         raise FileNotFoundError(f"Input file not found: {input_path}")
 
-    with input_path.open("r", encoding="utf-8") as handle:
-        data = json.load(handle)
-
-    normalized = normalize_root(data, input_path.stem)
-    if not normalized:
-        raise ValueError(
-            "Cannot detect a supported conversation structure in input JSON. "
-            "Please provide a sample format so the parser can be extended."
-        )
-
-    output_dir.mkdir(parents=True, exist_ok=True)
-    if args.clean:
-        for md_file in output_dir.glob("*.md"):
-            md_file.unlink()
-
-    name_counter: defaultdict[str, int] = defaultdict(int)
-    written = 0
-    exported_with_qa = 0
-
-    for index, conversation in enumerate(normalized, start=1):
-        raw_title = (conversation.get("title") or "").strip() or f"{input_path.stem}-{index}"
-        base_name = clean_filename(raw_title)
-        name_counter[base_name] += 1
-        duplicate_index = name_counter[base_name]
-        filename = f"{base_name}.md" if duplicate_index == 1 else f"{base_name} ({duplicate_index}).md"
-
-        turns = conversation.get("turns") or []
-        qa_lines = extract_qa_lines(turns)
-        lines = [f"# {raw_title}", ""]
-        if qa_lines:
-            lines.extend(qa_lines)
-            exported_with_qa += 1
+    timings: dict[str, float] = {}
+    run_started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if args.stream:
+            handle = stack.enter_context(input_path.open("r", encoding="utf-8"))
+            loader_name = "streaming json"
+            conversations: Iterator[Conversation] = timed_iter(
+                iter_streamed_conversations(handle, input_path.stem, args.current_branch),
+                timings,
+                "load+normalize",
+            )
         else:
-            lines.append("（无可导出的问答内容）")
-            lines.append("")
-
-        (output_dir / filename).write_text("\n".join(lines).rstrip() + "\n", encoding="utf-8")
-        written += 1
-
-    print(f"Detected conversations: {len(normalized)}")
-    print(f"Converted files: {written}")
-    print(f"Files with Q/A content: {exported_with_qa}")
-    print(f"Output directory: {output_dir}")
+            started = time.perf_counter()
+            data, loader_name = load_json(input_path, args.loader)
+            timings["load"] = time.perf_counter() - started
+            started = time.perf_counter()
+            normalized = normalize_root(data, input_path.stem, args.current_branch)
+            del data
+            timings["normalize"] = time.perf_counter() - started
+            conversations = iter(normalized)
+
+        write_started = time.perf_counter()
+        first = next(conversations, None)
+        if first is None:
+            raise ValueError(
+                "Cannot detect a supported conversation structure in input JSON. "
+                "Please provide a sample format so the parser can be extended."
+            )
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        if args.clean and args.output_format == "dir":
+            for md_file in output_dir.glob("*.md"):
+                if not md_file.name.lower().endswith(BUNDLE_MD_SUFFIX):
+                    md_file.unlink()
+
+        with open_output_backend(args.output_format, output_dir, input_path.stem, args.io_threads) as backend:
+            stats = write_conversations(
+                itertools.chain([first], conversations),
+                output_dir,
+                input_path.stem,
+                workers=args.workers,
+                incremental=args.incremental,
+                backend=backend,
+            )
+        timings["render+write"] = time.perf_counter() - write_started - timings.get("load+normalize", 0.0)
+    timings["total"] = time.perf_counter() - run_started
+
+    print(f"Detected conversations: {stats['detected']}")
+    print(f"Converted files: {stats['written']}")
+    print(f"Files with Q/A content: {stats['with_qa']}")
+    if args.incremental:
+        print(f"Unchanged files skipped: {stats['skipped']}")
+        print(f"Stale files removed: {stats['removed']}")
+    if args.output_format == "dir":
+        print(f"Output directory: {output_dir}")
+    else:
+        print(f"Output file: {backend.location}")
+    print(f"JSON loader: {loader_name}")
+    print("Timing: " + " | ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
     return 0
 
 
@@ -0,0 +1,382 @@
+"""
+yuque-lakebook-export 的性能基准，使用按语雀 Lake 正文结构生成的文档，不需要真实的 lakebook。
+
+    python scripts/benchmark.py parser --docs 100
+    python scripts/benchmark.py table --rows 10000
+    python scripts/benchmark.py markdown --lines 1000000
+    python scripts/benchmark.py toc --entries 20000
+    python scripts/benchmark.py links --docs 5000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import urllib.parse
+
+import yaml
+
+from yuque_lakebook_export.lake_dom import PARSER_BACKENDS, available_parser_backends, parse_html
+from yuque_lakebook_export.lake_handle import DocLinkIndex, MyContext, MyParser, encode_markdown_path
+from yuque_lakebook_export.lake_reader import LakeBookDirectory, TocCache, TocLoader
+from yuque_lakebook_export.lake_setup import GlobalContext, LakeToMd, load_meta_json, normalize_markdown
+
+WORDS = ["语雀", "文档", "导出", "Markdown", "lakebook", "图片", "表格", "代码", "the", "export", "parser", "快速",
+         "链接", "标题", "列表", "引用", "emoji 🎉", "A&B", "1 < 2"]
+COLORS = ["#E8323C", "#1DC0C9", "#74B602", "#ED740C"]
+
+
+def lake_id(rng):
+    return "u" + "".join(rng.choice("0123456789abcdef") for _ in range(8))
+
+
+def card(name, data, card_type="inline"):
+    value = urllib.parse.quote(json.dumps(data, ensure_ascii=False))
+    return '<card type="{}" name="{}" value="data:{}"></card>'.format(card_type, name, value)
+
+
+def lake_text(rng):
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 16)))
+    return words.replace("&", "&amp;").replace("<", "&lt;")
+
+
+def lake_span(rng):
+    text = lake_text(rng)
+    roll = rng.random()
+    if roll < 0.1:
+        text = "<strong>{}</strong>".format(text)
+    elif roll < 0.15:
+        text = "<em>{}</em>".format(text)
+    elif roll < 0.2:
+        text = "<code>{}</code>".format(text)
+    elif roll < 0.25:
+        text = '<a href="https://www.yuque.com/docs/{}" target="_blank">{}</a>'.format(lake_id(rng), text)
+    elif roll < 0.3:
+        return '<span style="color: {}">{}</span>'.format(rng.choice(COLORS), text)
+    return '<span data-lake-id="{0}" id="{0}">{1}</span>'.format(lake_id(rng), text)
+
+
+def lake_paragraph(rng, tag="p"):
+    spans = "".join(lake_span(rng) for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.1:
+        spans += "&nbsp;<br />"
+    return '<{0} data-lake-id="{1}" id="{1}">{2}</{0}>'.format(tag, lake_id(rng), spans)
+
+
+def lake_block(rng):
+    roll = rng.random()
+    if roll < 0.45:
+        return lake_paragraph(rng)
+    if roll < 0.55:
+        return lake_paragraph(rng, "h{}".format(rng.randint(1, 4)))
+    if roll < 0.65:
+        tag = rng.choice(["ul", "ol"])
+        items = "".join('<li fid="{}" data-lake-id="{}">{}</li>'.format(lake_id(rng), lake_id(rng), lake_span(rng))
+                        for _ in range(rng.randint(2, 8)))
+        return '<{0} list="{1}">{2}</{0}>'.format(tag, lake_id(rng), items)
+    if roll < 0.72:
+        columns = rng.randint(2, 5)
+        colgroup = "".join('<col width="{}" />'.format(rng.randint(80, 300)) for _ in range(columns))
+        rows = "".join('<tr style="height: 33px">' + "".join(
+            "<td>{}</td>".format(lake_paragraph(rng)) for _ in range(columns)) + "</tr>"
+                       for _ in range(rng.randint(2, 12)))
+        return ('<table class="lake-table" style="width: 750px"><colgroup>{}</colgroup>'
+                '<tbody>{}</tbody></table>').format(colgroup, rows)
+    if roll < 0.78:
+        code = "\n".join("print({!r})".format(lake_text(rng)) for _ in range(rng.randint(1, 20)))
+        return card("codeblock", {"mode": "python", "code": code, "id": lake_id(rng)}, "block")
+    if roll < 0.84:
+        return "<p>{}</p>".format(card("image", {
+            "src": "https://cdn.nlark.com/yuque/0/2024/png/{}.png".format(lake_id(rng)),
+            "name": "image.png", "originWidth": 1280, "originHeight": 720,
+            "crop": [0, 0, 1, 1], "id": lake_id(rng),
+        }))
+    if roll < 0.88:
+        return "<blockquote>{}</blockquote>".format(lake_paragraph(rng))
+    if roll < 0.9:
+        nodes = [{"html": "<p><span>{}</span></p>".format(lake_text(rng)),
+                  "children": [{"html": "<p>{}</p>".format(lake_text(rng))} for _ in range(rng.randint(0, 4))]}
+                 for _ in range(rng.randint(1, 6))]
+        return card("board", {"diagramData": {"body": nodes}}, "block")
+    if roll < 0.95:
+        return "<p>{}</p>".format(card("yuque", {
+            "src": "https://www.yuque.com/team/book/{}".format(lake_id(rng)),
+            "detail": {"title": lake_text(rng)},
+        }))
+    return card("hr", {}, "block")
+
+
+def lake_body(rng, blocks):
+    """
+    生成一篇结构接近语雀导出的 Lake 正文：meta 头、带 data-lake-id 的段落和 span、列表、
+    带 colgroup 的表格、代码块/图片/画板/文档链接等卡片
+    """
+    head = ('<!doctype lake><meta name="doc-version" content="1" /><meta name="viewport" content="fixed" />'
+            '<meta name="typography" content="classic" />')
+    return head + "".join(lake_block(rng) for _ in range(blocks))
+
+
+def make_corpus(docs, min_blocks, max_blocks, seed):
+    rng = random.Random(seed)
+    return [LakeToMd._normalize_body(lake_body(rng, rng.randint(min_blocks, max_blocks))) for _ in range(docs)]
+
+
+def convert(body, backend, image_target):
+    parser = MyParser(body, backend)
+    context = MyContext(filename="doc", download_image=False, image_target=image_target)
+    return normalize_markdown(parser.to_markdown(parser.soup, context))
+
+
+def best_time(repeat, func):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_parser_benchmark(args):
+    corpus = make_corpus(args.docs, args.min_blocks, args.max_blocks, args.seed)
+    size_mb = sum(len(body.encode("utf-8")) for body in corpus) / 1024 / 1024
+    backends = args.backend or available_parser_backends()
+    print("语料: {} 篇文档，{:.1f} MB；每项取 {} 次中的最快值".format(len(corpus), size_mb, args.repeat))
+    print("{:<12}{:>12}{:>12}{:>12}{:>14}".format("backend", "parse(s)", "MB/s", "convert(s)", "same-as-bs4"))
+    with tempfile.TemporaryDirectory() as image_target:
+        reference = [convert(body, "bs4", image_target) for body in corpus]
+        for backend in backends:
+            outputs = []
+
+            def parse_all():
+                for body in corpus:
+                    parse_html(body, backend)
+
+            def convert_all():
+                outputs[:] = [convert(body, backend, image_target) for body in corpus]
+
+            parse_seconds = best_time(args.repeat, parse_all)
+            convert_seconds = best_time(args.repeat, convert_all)
+            same = sum(1 for expected, actual in zip(reference, outputs) if expected == actual)
+            print("{:<12}{:>12.3f}{:>12.2f}{:>12.3f}{:>9}/{:<4}".format(
+                backend, parse_seconds, size_mb / parse_seconds, convert_seconds, same, len(corpus)))
+
+
+def table_body(rng, rows, columns, depth):
+    """
+    生成一篇只有一个大表格和一个同样长度列表的文档，表格外可再套 depth 层 blockquote/span
+    """
+    cells = "".join('<tr style="height: 33px">' + "".join(
+        "<td>{}</td>".format(lake_paragraph(rng)) for _ in range(columns)) + "</tr>" for _ in range(rows))
+    table = '<table class="lake-table"><tbody>{}</tbody></table>'.format(cells)
+    items = "".join("<li>{}</li>".format(lake_span(rng)) for _ in range(rows))
+    return "<blockquote><span>" * depth + table + "</span></blockquote>" * depth + "<ul>{}</ul>".format(items)
+
+
+def run_table_benchmark(args):
+    print("表格 {} 列，外层嵌套 {} 层；每项取 {} 次中的最快值".format(args.columns, args.depth, args.repeat))
+    print("{:>10}{:>12}{:>14}{:>14}".format("rows", "convert(s)", "us/row", "markdown(MB)"))
+    with tempfile.TemporaryDirectory() as image_target:
+        # 逐级翻倍行数，耗时随行数线性增长时 us/row 应基本不变
+        for rows in (args.rows // 4, args.rows // 2, args.rows):
+            parser = MyParser(table_body(random.Random(args.seed), rows, args.columns, args.depth))
+            markdown = []
+
+            def convert_table():
+                context = MyContext(filename="doc", download_image=False, image_target=image_target)
+                markdown[:] = [parser.to_markdown(parser.soup, context)]
+
+            seconds = best_time(args.repeat, convert_table)
+            print("{:>10}{:>12.3f}{:>14.1f}{:>14.1f}".format(
+                rows, seconds, seconds / rows * 1000000, len(markdown[0].encode("utf-8")) / 1024 / 1024))
+
+
+def markdown_text(rng, lines):
+    """
+    生成一篇约 lines 行的 Markdown：标题、段落、表格、代码块、分割线交替出现，块之间夹着长短不一的空行
+    """
+    blocks = []
+    count = 0
+    while count < lines:
+        roll = rng.random()
+        if roll < 0.1:
+            block = ["#" * rng.randint(1, 6) + " " + lake_text(rng)]
+        elif roll < 0.2:
+            block = ["| a | b |", "| --- | --- |"] + ["| {} | {} |".format(lake_text(rng), lake_text(rng))
+                                                     for _ in range(rng.randint(1, 20))]
+        elif roll < 0.3:
+            block = ["```python"] + ["print({!r})".format(lake_text(rng)) for _ in range(rng.randint(1, 20))] + ["```"]
+        elif roll < 0.35:
+            block = ["---"]
+        else:
+            block = [lake_text(rng) + " " for _ in range(rng.randint(1, 5))]
+        block += [""] * rng.choice([0, 0, 1, 1, 2, 10, 100])
+        blocks.extend(block)
+        count += len(block)
+    return "\n".join(blocks[:lines])
+
+
+def run_markdown_benchmark(args):
+    print("Markdown 后处理(normalize_markdown)；每项取 {} 次中的最快值".format(args.repeat))
+    print("{:>10}{:>12}{:>14}".format("lines", "seconds", "us/line"))
+    text = markdown_text(random.Random(args.seed), args.lines)
+    lines = text.split("\n")
+    # 逐级翻倍行数，耗时随行数线性增长时 us/line 应基本不变
+    for count in (args.lines // 4, args.lines // 2, args.lines):
+        part = "\n".join(lines[:count])
+        seconds = best_time(args.repeat, lambda: normalize_markdown(part))
+        print("{:>10}{:>12.3f}{:>14.2f}".format(count, seconds, seconds / count * 1000000))
+
+
+def toc_meta(rng, entries):
+    """
+    生成含 entries 个目录条目的 $meta.json 内容，条目字段与语雀导出的 tocYml 相同
+    """
+    toc = [{"type": "META", "count": entries, "display_level": "all", "tail_type": "DOC", "base_version_id": 1}]
+    for index in range(entries):
+        parent = "" if index < 10 else "u{}".format(rng.randrange(0, index))
+        toc.append({
+            "type": "TITLE" if index % 7 == 3 else "DOC", "title": lake_text(rng), "uuid": "u{}".format(index),
+            "url": lake_id(rng), "prev_uuid": "", "sibling_uuid": "", "child_uuid": "", "parent_uuid": parent,
+            "doc_id": 100000 + index, "level": 1, "id": 100000 + index, "open_window": 1, "visible": 1,
+        })
+    book = {"tocYml": yaml.safe_dump(toc, allow_unicode=True, sort_keys=False)}
+    return json.dumps({"meta": json.dumps({"book": book}, ensure_ascii=False)}, ensure_ascii=False).encode("utf-8")
+
+
+def run_toc_benchmark(args):
+    meta_bytes = toc_meta(random.Random(args.seed), args.entries)
+    print("目录 {} 条，$meta.json {:.1f} MB；每项取 {} 次中的最快值".format(
+        args.entries, len(meta_bytes) / 1024 / 1024, args.repeat))
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "$meta.json"), "wb") as fp:
+            fp.write(meta_bytes)
+        toc_cache = TocCache(os.path.join(workdir, "toc"))
+
+        def load(cache=None):
+            context = GlobalContext()
+            context.source = LakeBookDirectory(workdir)
+            context.toc_cache = cache
+            load_meta_json(context)
+
+        def load_full_loader():
+            book_yml = json.loads(json.loads(meta_bytes)["meta"])["book"]["tocYml"]
+            yaml.load(book_yml, yaml.Loader)
+
+        load(toc_cache)
+        print("{:<28}{:>10}".format("loader", "seconds"))
+        if args.include_full_loader:
+            print("{:<28}{:>10.3f}".format("yaml.Loader", best_time(args.repeat, load_full_loader)))
+        print("{:<28}{:>10.3f}".format(TocLoader.__name__, best_time(args.repeat, load)))
+        print("{:<28}{:>10.3f}".format("TocCache hit", best_time(args.repeat, lambda: load(toc_cache))))
+
+
+def link_wiki(rng, docs, links):
+    """
+    生成 docs 篇文档的目录树路径，以及每篇文档中 links 个语雀链接卡片的数据。
+    链接目标集中在少数常用文档上，约 5% 指向不存在的文档
+    """
+    paths = []
+    for index in range(docs):
+        depth = rng.randint(0, 4)
+        parts = ["分组 {}".format(rng.randrange(8)) for _ in range(depth)]
+        paths.append(os.path.join("/wiki", *parts, "文档 {}.md".format(index)))
+    link_index = DocLinkIndex()
+    for index, path in enumerate(paths):
+        link_index.add(path, "uuid{}".format(index), "doc{}".format(index), str(index))
+    cards = []
+    for _ in range(docs):
+        doc_cards = []
+        for _ in range(links):
+            target = min(docs - 1, int(rng.paretovariate(0.8)) - 1)
+            slug = "doc{}".format(target) if rng.random() > 0.05 else "nowhere{}".format(target)
+            url = "https://www.yuque.com/x/y/" + slug
+            doc_cards.append({"src": url, "detail": {"url": url, "doc_id": target, "title": slug}})
+        cards.append(doc_cards)
+    return paths, link_index, cards
+
+
+class UncachedLinkIndex(DocLinkIndex):
+    """
+    原来的做法：每个链接都重新计算 relpath 和 URL 编码
+    """
+
+    def relative_link(self, target_path, current_dir):
+        relative_path = os.path.relpath(target_path, current_dir) if current_dir else target_path
+        return encode_markdown_path(relative_path.replace(os.path.sep, "/"))
+
+
+def run_links_benchmark(args):
+    paths, link_index, cards = link_wiki(random.Random(args.seed), args.docs, args.links)
+    parser = MyParser("")
+    print("文档 {} 篇，每篇 {} 个语雀链接；每项取 {} 次中的最快值".format(args.docs, args.links, args.repeat))
+
+    uncached_index = UncachedLinkIndex(link_index.paths)
+
+    def resolve_all(index):
+        # 每轮从空缓存开始，只复用同一次导出中积累的相对链接
+        index.relative_links.clear()
+        for path, doc_cards in zip(paths, cards):
+            context = MyContext(filename="doc", download_image=False, current_file_path=path, link_index=index)
+            for data_json in doc_cards:
+                parser.handle_yuque_card(data_json, context)
+
+    print("{:<28}{:>10}".format("resolver", "seconds"))
+    print("{:<28}{:>10.3f}".format("relpath per link", best_time(args.repeat, lambda: resolve_all(uncached_index))))
+    print("{:<28}{:>10.3f}".format(DocLinkIndex.__name__, best_time(args.repeat, lambda: resolve_all(link_index))))
+    print("链接 {} 个，相对链接缓存 {} 项".format(args.docs * args.links, len(link_index.relative_links)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the yuque-lakebook-export converter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_bench = subparsers.add_parser("parser", help="对比各正文解析后端的解析与转换耗时")
+    parser_bench.add_argument("--docs", type=int, default=100, help="文档数量(默认 100)")
+    parser_bench.add_argument("--min-blocks", type=int, default=20, help="每篇文档最少块数(默认 20)")
+    parser_bench.add_argument("--max-blocks", type=int, default=200, help="每篇文档最多块数(默认 200)")
+    parser_bench.add_argument("--backend", action="append", choices=PARSER_BACKENDS[1:],
+                              help="只测指定后端，可重复(默认全部可用后端)")
+    parser_bench.add_argument("--repeat", type=int, default=3, help="每项重复次数(默认 3)")
+    parser_bench.add_argument("--seed", type=int, default=0, help="随机种子(默认 0)")
+
+    table_bench = subparsers.add_parser("table", help="大表格/长列表文档的 Markdown 生成耗时，检查是否随行数线性增长")
+    table_bench.add_argument("--rows", type=int, default=10000, help="表格行数和列表项数(默认 10000)")
+    table_bench.add_argument("--columns", type=int, default=4, help="表格列数(默认 4)")
+    table_bench.add_argument("--depth", type=int, default=0, help="表格外层嵌套的 blockquote/span 层数(默认 0)")
+    table_bench.add_argument("--repeat", type=int, default=3, help="每项重复次数(默认 3)")
+    table_bench.add_argument("--seed", type=int, default=0, help="随机种子(默认 0)")
+
+    markdown_bench = subparsers.add_parser("markdown", help="Markdown 后处理耗时，检查是否随行数线性增长")
+    markdown_bench.add_argument("--lines", type=int, default=1000000, help="Markdown 行数(默认 1000000)")
+    markdown_bench.add_argument("--repeat", type=int, default=3, help="每项重复次数(默认 3)")
+    markdown_bench.add_argument("--seed", type=int, default=0, help="随机种子(默认 0)")
+
+    toc_bench = subparsers.add_parser("toc", help="目录(tocYml)解析耗时：YAML 加载器与解析结果缓存")
+    toc_bench.add_argument("--entries", type=int, default=20000, help="目录条目数(默认 20000)")
+    toc_bench.add_argument("--include-full-loader", action="store_true",
+                           help="同时测原来的纯 Python yaml.Loader(很慢)")
+    toc_bench.add_argument("--repeat", type=int, default=3, help="每项重复次数(默认 3)")
+    toc_bench.add_argument("--seed", type=int, default=0, help="随机种子(默认 0)")
+
+    links_bench = subparsers.add_parser("links", help="内部文档链接解析耗时：逐个计算相对路径与链接索引")
+    links_bench.add_argument("--docs", type=int, default=5000, help="文档数量(默认 5000)")
+    links_bench.add_argument("--links", type=int, default=20, help="每篇文档的语雀链接数(默认 20)")
+    links_bench.add_argument("--repeat", type=int, default=3, help="每项重复次数(默认 3)")
+    links_bench.add_argument("--seed", type=int, default=0, help="随机种子(默认 0)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.command == "parser":
+        run_parser_benchmark(arguments)
+    elif arguments.command == "table":
+        run_table_benchmark(arguments)
+    elif arguments.command == "markdown":
+        run_markdown_benchmark(arguments)
+    elif arguments.command == "toc":
+        run_toc_benchmark(arguments)
+    elif arguments.command == "links":
+        run_links_benchmark(arguments)
@@ -0,0 +1,349 @@
+"""
+Lake 正文（HTML）的解析后端。
+
+MyParser 的 handle_* 只用到节点的 name、attrs、contents、text、len() 和 tag.tbody，
+这里用轻量的 LakeNode 实现这组接口，文本节点仍是 bs4 的 NavigableString（及 Comment 等子类），
+因此 isinstance 判断和 handle_* 方法无需改动。各后端只负责把开始标签、结束标签和文本事件
+交给 LakeTreeBuilder，空白折叠、标签闭合等规则与 BeautifulSoup(html, 'html.parser') 保持一致。
+
+- bs4: 原来的 BeautifulSoup(html, 'html.parser') 对象树
+- htmlparser: 复用 bs4 的 html.parser 分词，只是不再构建 BeautifulSoup 对象树，输出与 bs4 完全一致；
+  它依赖 bs4 的私有模块并照搬了 4.12 版的回调，bs4 版本不同时不可用，auto 改用 bs4
+- lxml / selectolax: C 实现的解析器，安装后可用；它们按 libxml2 / HTML5 规则补全标签，
+  遇到不规范的嵌套时结果可能与 bs4 不同
+"""
+from collections import defaultdict
+
+import bs4
+from bs4 import BeautifulSoup, CData, Comment, NavigableString
+from bs4.builder import HTMLTreeBuilder
+
+# LakeTreeBuilder 照搬的是这个版本的 BeautifulSoupHTMLParser 回调
+HTMLPARSER_BS4_VERSION = "4.12."
+
+try:
+    from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+except ImportError:
+    BeautifulSoupHTMLParser = None
+if not bs4.__version__.startswith(HTMLPARSER_BS4_VERSION):
+    BeautifulSoupHTMLParser = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+ROOT_TAG_NAME = "[document]"
+PARSER_BACKENDS = ("auto", "htmlparser", "bs4", "lxml", "selectolax")
+DEFAULT_PARSER_BACKEND = "auto"
+# auto 只选择与 bs4 输出一致的后端
+AUTO_PARSER_BACKEND = "htmlparser" if BeautifulSoupHTMLParser is not None else "bs4"
+# 后端不可用时提示需要安装的包
+PARSER_REQUIREMENTS = {
+    "htmlparser": "beautifulsoup4 " + HTMLPARSER_BS4_VERSION + "x",
+    "lxml": "lxml",
+    "selectolax": "selectolax",
+}
+
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+EMPTY_ELEMENT_TAGS = HTMLTreeBuilder.empty_element_tags
+PRESERVE_WHITESPACE_TAGS = HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS
+STRING_CONTAINERS = HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS
+DEFAULT_INTERESTING_STRING_TYPES = (NavigableString, CData)
+
+
+class LakeNode:
+    """
+    轻量的标签节点，接口与 bs4 的 Tag 相同的部分：name、attrs、contents、text、get_text()、
+    len()，以及 node.tbody 这类按名称查找第一个后代节点的写法。attrs 中的值均为原始字符串。
+    """
+    __slots__ = ("name", "attrs", "contents")
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs if attrs is not None else {}
+        self.contents = []
+
+    def __len__(self):
+        return len(self.contents)
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        return iter(self.contents)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self.find(name)
+
+    def __getstate__(self):
+        return self.name, self.attrs, self.contents
+
+    def __setstate__(self, state):
+        self.name, self.attrs, self.contents = state
+
+    def __repr__(self):
+        return "<LakeNode {}>".format(self.name)
+
+    @property
+    def is_empty_element(self):
+        return not self.contents and self.name in EMPTY_ELEMENT_TAGS
+
+    @property
+    def descendants(self):
+        stack = [iter(self.contents)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            yield child
+            if isinstance(child, LakeNode):
+                stack.append(iter(child.contents))
+
+    def find(self, name):
+        for child in self.descendants:
+            if isinstance(child, LakeNode) and child.name == name:
+                return child
+        return None
+
+    def get_text(self, separator="", strip=False):
+        types = STRING_CONTAINERS.get(self.name)
+        strings = []
+        # 大多数标签只含文本节点，不必展开整棵子树
+        nodes = self.contents
+        for child in nodes:
+            if isinstance(child, LakeNode):
+                nodes = self.descendants
+                break
+        for child in nodes:
+            if isinstance(child, LakeNode):
+                continue
+            child_type = type(child)
+            if types is not None:
+                if child_type is not types:
+                    continue
+            elif child_type not in DEFAULT_INTERESTING_STRING_TYPES:
+                continue
+            if strip:
+                child = child.strip()
+                if not child:
+                    continue
+            strings.append(child)
+        return separator.join(strings)
+
+    text = property(get_text)
+
+
+class LakeTreeBuilder:
+    """
+    用解析事件构建 LakeNode 树，闭合标签、空白折叠和字符串类型的规则照搬 BeautifulSoup：
+    结束标签会弹出到最近一个同名的未闭合标签，找不到同名标签时忽略；
+    pre/textarea 之外只含 ASCII 空白的文本折叠为一个空格或换行。
+    也作为 BeautifulSoupHTMLParser 的 soup 对象使用。
+    """
+    ROOT_TAG_NAME = ROOT_TAG_NAME
+    original_encoding = None
+
+    def __init__(self):
+        self.root = LakeNode(ROOT_TAG_NAME)
+        self.tag_stack = [self.root]
+        self.current_tag = self.root
+        self.current_data = []
+        self.open_tag_counter = defaultdict(int)
+        self.preserve_whitespace_tag_stack = []
+        self.string_container_stack = []
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs, sourceline=None, sourcepos=None, namespaces=None):
+        self.endData()
+        tag = LakeNode(name, attrs)
+        self.current_tag.contents.append(tag)
+        self.tag_stack.append(tag)
+        self.current_tag = tag
+        self.open_tag_counter[name] += 1
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace_tag_stack.append(tag)
+        if name in STRING_CONTAINERS:
+            self.string_container_stack.append(tag)
+        return tag
+
+    def handle_endtag(self, name, nsprefix=None):
+        self.endData()
+        if name == ROOT_TAG_NAME or not self.open_tag_counter.get(name):
+            return
+        while len(self.tag_stack) > 1:
+            tag = self.pop_tag()
+            if tag.name == name:
+                break
+
+    def pop_tag(self):
+        tag = self.tag_stack.pop()
+        self.open_tag_counter[tag.name] -= 1
+        if self.preserve_whitespace_tag_stack and tag is self.preserve_whitespace_tag_stack[-1]:
+            self.preserve_whitespace_tag_stack.pop()
+        if self.string_container_stack and tag is self.string_container_stack[-1]:
+            self.string_container_stack.pop()
+        self.current_tag = self.tag_stack[-1]
+        return tag
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def handle_comment(self, data):
+        self.endData()
+        self.handle_data(data)
+        self.endData(Comment)
+
+    def endData(self, containerClass=None):
+        if not self.current_data:
+            return
+        current_data = ''.join(self.current_data)
+        self.current_data = []
+        if not self.preserve_whitespace_tag_stack:
+            for char in current_data:
+                if char not in ASCII_SPACES:
+                    break
+            else:
+                current_data = '\n' if '\n' in current_data else ' '
+        container = containerClass or NavigableString
+        if self.string_container_stack and container is NavigableString:
+            container = STRING_CONTAINERS.get(self.string_container_stack[-1].name, container)
+        self.current_tag.contents.append(container(current_data))
+
+    def finish(self):
+        self.endData()
+        return self.root
+
+
+def parse_with_htmlparser(html_text):
+    builder = LakeTreeBuilder()
+    parser = BeautifulSoupHTMLParser(convert_charrefs=False)
+    parser.soup = builder
+    parser.feed(html_text)
+    parser.close()
+    return builder.finish()
+
+
+def parse_with_lxml(html_text):
+    builder = LakeTreeBuilder()
+    document = None
+    if html_text:
+        parser = etree.HTMLParser(remove_comments=False, huge_tree=True, no_network=True)
+        document = etree.fromstring(html_text, parser)
+    if document is None:
+        return builder.finish()
+    # libxml2 会补出 html/head/body，这里只取 head 和 body 的内容
+    for section in document:
+        if not isinstance(section.tag, str):
+            continue
+        if section.text:
+            builder.handle_data(section.text)
+        stack = [(None, iter(section))]
+        while stack:
+            element, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if element is not None:
+                    builder.handle_endtag(element.tag)
+                    if element.tail:
+                        builder.handle_data(element.tail)
+                continue
+            if isinstance(child.tag, str):
+                builder.handle_starttag(child.tag, None, None, dict(child.attrib))
+                if child.text:
+                    builder.handle_data(child.text)
+                stack.append((child, iter(child)))
+                continue
+            if child.tag is etree.Comment:
+                builder.handle_comment(child.text or "")
+            if child.tail:
+                builder.handle_data(child.tail)
+    return builder.finish()
+
+
+def parse_with_selectolax(html_text):
+    builder = LakeTreeBuilder()
+    document = LexborHTMLParser(html_text or "")
+    # lexbor 会补出 html/head/body，这里只取 head 和 body 的内容
+    for section in (document.head, document.body):
+        if section is None:
+            continue
+        stack = [(None, section.child)]
+        while stack:
+            element, node = stack.pop()
+            if node is None:
+                if element is not None:
+                    builder.handle_endtag(element.tag)
+                continue
+            stack.append((element, node.next))
+            tag = node.tag
+            if tag == "-text":
+                builder.handle_data(node.text_content or "")
+            elif tag == "-comment":
+                builder.handle_comment(node.comment_content or "")
+            elif not tag.startswith("-"):
+                attrs = {key: "" if value is None else value for key, value in node.attributes.items()}
+                builder.handle_starttag(tag, None, None, attrs)
+                stack.append((node, node.child))
+    return builder.finish()
+
+
+def parse_with_bs4(html_text):
+    return BeautifulSoup(html_text, 'html.parser')
+
+
+PARSERS = {
+    "htmlparser": parse_with_htmlparser,
+    "bs4": parse_with_bs4,
+    "lxml": parse_with_lxml,
+    "selectolax": parse_with_selectolax,
+}
+
+
+def parser_backend_available(backend):
+    if backend == "htmlparser":
+        return BeautifulSoupHTMLParser is not None
+    if backend == "lxml":
+        return etree is not None
+    if backend == "selectolax":
+        return LexborHTMLParser is not None
+    return backend in PARSER_BACKENDS
+
+
+def parser_backend_unavailable_message(backend):
+    return "解析后端 {} 不可用，请先安装 {}".format(backend, PARSER_REQUIREMENTS.get(backend, backend))
+
+
+def available_parser_backends():
+    return [backend for backend in PARSER_BACKENDS if backend != "auto" and parser_backend_available(backend)]
+
+
+def resolve_parser_backend(backend=None):
+    """
+    :param backend: PARSER_BACKENDS 之一，None 等同 auto
+    :return: 实际使用的后端名称
+    """
+    backend = backend or DEFAULT_PARSER_BACKEND
+    if backend == "auto":
+        return AUTO_PARSER_BACKEND
+    if backend not in PARSER_BACKENDS:
+        raise ValueError("未知的解析后端: {}，可选: {}".format(backend, ", ".join(PARSER_BACKENDS)))
+    if not parser_backend_available(backend):
+        raise ValueError(parser_backend_unavailable_message(backend))
+    return backend
+
+
+def parse_html(html_text, backend=None):
+    """
+    解析 Lake 正文，返回根节点（名称为 [document]）
+    :param backend: PARSER_BACKENDS 之一，None 等同 auto
+    """
+    return PARSERS[resolve_parser_backend(backend)](html_text)
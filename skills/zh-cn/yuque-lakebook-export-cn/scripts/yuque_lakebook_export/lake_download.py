@@ -0,0 +1,468 @@
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 默认下载参数，可通过 ResourceDownloader 的关键字参数覆盖
+DEFAULT_DOWNLOAD_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 4
+DEFAULT_RATE_LIMIT = 10.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+# 共享 HTTP 会话的默认参数
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+# 这些响应码视为临时错误，会按退避策略重试
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class PooledSession:
+    """
+    带连接池和 keep-alive 的 HTTP 会话，同一域名的下载复用 TCP/TLS 连接，并统计连接复用情况。
+    :param pool_size: 每个域名保留的连接数，连接用尽时请求会等待空闲连接而不是新建
+    :param connect_timeout: 建立连接超时（秒）
+    :param read_timeout: 读取响应超时（秒）
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.session = requests.Session()
+        self.session.headers["Connection"] = "keep-alive"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            "http": self.counting_pool(HTTPConnectionPool),
+            "https": self.counting_pool(HTTPSConnectionPool),
+        }
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def counting_pool(self, pool_class):
+        pooled_session = self
+
+        class CountingConnectionPool(pool_class):
+            def _new_conn(self):
+                with pooled_session.lock:
+                    pooled_session.connection_count += 1
+                return super()._new_conn()
+
+        return CountingConnectionPool
+
+    def get(self, url):
+        with self.lock:
+            self.request_count += 1
+        return self.session.get(url, timeout=self.timeout)
+
+    def stats(self):
+        """
+        :return: {"requests": 请求数, "connections": 新建连接数, "reused": 复用连接的请求数}
+        """
+        with self.lock:
+            return {
+                "requests": self.request_count,
+                "connections": self.connection_count,
+                "reused": max(0, self.request_count - self.connection_count),
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def get_shared_session(**session_options):
+    """
+    获取进程内共享的 PooledSession，批量导出多个 lakebook 时复用同一组连接。
+    参数只在首次创建时生效。
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = PooledSession(**session_options)
+        return _shared_session
+
+
+def diff_session_stats(before, after):
+    return {key: after[key] - before.get(key, 0) for key in after}
+
+
+class AssetStore:
+    """
+    跨文档、跨 lakebook、跨多次运行共享的资源缓存。
+    refs/ 下以“源地址 + 裁剪参数”的哈希为键，记录资源内容的 sha256；
+    objects/ 下按内容 sha256 保存文件本体，相同内容只保存一份。
+    各文档 .assets 目录中的文件默认从缓存复制，修改导出的图片不会影响缓存。
+    :param link: 改用硬链接指向缓存（无法硬链接时仍复制），节省磁盘空间；此时命中缓存会先校验文件的 sha256，
+                 缓存文件被改动过时删除并重新下载
+    """
+
+    def __init__(self, root, link=False):
+        self.root = os.path.abspath(os.path.expanduser(str(root)))
+        self.link = link
+        # {缓存键: [锁, 使用中的线程数]}，没有线程使用时移除
+        self.key_locks = {}
+        self.key_locks_lock = threading.Lock()
+
+    @staticmethod
+    def shard_path(base, digest):
+        return os.path.join(base, digest[:2], digest)
+
+    @contextmanager
+    def key_lock(self, cache_key):
+        """
+        同一缓存键同时只允许一个线程查询和下载，结束后没有其他线程等待时释放这把锁
+        """
+        with self.key_locks_lock:
+            entry = self.key_locks.get(cache_key)
+            if entry is None:
+                entry = [threading.Lock(), 0]
+                self.key_locks[cache_key] = entry
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.key_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.key_locks[cache_key]
+
+    def lookup(self, cache_key):
+        """
+        :return: 缓存文件路径，未缓存时返回 None
+        """
+        ref_path = self.shard_path(os.path.join(self.root, "refs"), cache_key)
+        try:
+            with open(ref_path, 'r', encoding='utf-8') as fp:
+                digest = fp.read().strip()
+        except OSError:
+            return None
+        object_path = self.shard_path(os.path.join(self.root, "objects"), digest)
+        if not digest or not os.path.exists(object_path):
+            return None
+        if self.link and not self.verify(object_path, digest):
+            # 硬链接的文件在导出目录中被修改过，缓存内容已不可信
+            os.remove(object_path)
+            return None
+        return object_path
+
+    @staticmethod
+    def verify(object_path, digest):
+        sha256 = hashlib.sha256()
+        try:
+            with open(object_path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+        except OSError:
+            return False
+        return sha256.hexdigest() == digest
+
+    def put(self, cache_key, content):
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self.shard_path(os.path.join(self.root, "objects"), digest)
+        if not os.path.exists(object_path):
+            self.write_atomic(object_path, content)
+        ref_path = self.shard_path(os.path.join(self.root, "refs"), cache_key)
+        self.write_atomic(ref_path, digest.encode('utf-8'))
+        return object_path
+
+    @staticmethod
+    def write_atomic(path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def materialize(self, object_path, target_path):
+        """
+        将缓存文件放到文档的 .assets 目录：默认复制；link 为 True 时优先硬链接，跨文件系统等情况下复制
+        """
+        if os.path.lexists(target_path):
+            if self.link and os.path.samefile(object_path, target_path):
+                return
+            # 之前用硬链接导出的文件也要先删除，否则复制时会写回缓存文件
+            os.remove(target_path)
+        if self.link:
+            try:
+                os.link(object_path, target_path)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(object_path, target_path)
+
+
+class TokenBucket:
+    """
+    令牌桶限速器，替代每次下载前固定的 sleep。
+    :param rate: 每秒补充的令牌数，<= 0 表示不限速
+    :param capacity: 桶容量，即允许的突发请求数
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class ResourceGroup:
+    """
+    一篇文档的一组下载任务，全部结束后以失败下标集合回调 on_done。
+    """
+
+    def __init__(self, total, on_done):
+        self.remaining = total
+        self.failed = set()
+        self.on_done = on_done
+        self.lock = threading.Lock()
+
+    def finish_one(self, index, ok):
+        with self.lock:
+            if not ok:
+                self.failed.add(index)
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.on_done(self.failed)
+
+
+class ResourceDownloader:
+    """
+    图片/附件并发下载池：线程池 + 按域名并发上限 + 令牌桶限速 + 指数退避重试。
+    解析阶段只登记资源，下载在这里异步完成。
+    :param timer: StageTimer，累计 network（请求耗时）和 disk（写出资源）两个阶段
+    """
+
+    def __init__(self, max_workers=DEFAULT_DOWNLOAD_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                 rate_limit=DEFAULT_RATE_LIMIT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, session=None,
+                 asset_store=None, timer=None):
+        self.session = session or get_shared_session()
+        self.asset_store = asset_store
+        self.timer = timer
+        self.stats_lock = threading.Lock()
+        self.stats = {"downloaded": 0, "cache_hits": 0}
+        self.max_workers = max(1, max_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate_limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="lake-download")
+        # 限制排队中的任务数量，避免解析速度远超下载速度时占用过多内存
+        self.slots = threading.BoundedSemaphore(self.max_workers * 16)
+        self.host_limits = {}
+        self.host_lock = threading.Lock()
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+    def host_limit(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.host_lock:
+            limit = self.host_limits.get(host)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.per_host_limit)
+                self.host_limits[host] = limit
+            return limit
+
+    def submit_group(self, resources, on_done, scope=None):
+        """
+        提交一篇文档的全部资源
+        :param resources: [(request_url, target_path, cache_key), ...]
+        :param on_done: 全部完成后调用，参数为下载失败的资源下标集合
+        :param scope: 所属的 DownloadScope，下载统计和回调错误同时记到这里
+        """
+        if not resources:
+            on_done(set())
+            return
+        group = ResourceGroup(len(resources), on_done)
+        for index, (request_url, target_path, cache_key) in enumerate(resources):
+            self.slots.acquire()
+            self.executor.submit(self.run_task, group, index, request_url, target_path, cache_key, scope)
+
+    def run_task(self, group, index, request_url, target_path, cache_key, scope=None):
+        try:
+            if self.asset_store is None or not cache_key:
+                ok = self.download(request_url, target_path, scope)
+            else:
+                ok = self.download_cached(request_url, target_path, cache_key, scope)
+            group.finish_one(index, ok)
+        except Exception as ex:
+            # 回调本身出错时记录下来，在 close 时抛出
+            (scope or self).errors.append(ex)
+        finally:
+            self.slots.release()
+
+    def timed(self, name, scope=None):
+        timer = scope.timer if scope is not None else self.timer
+        return timer.stage(name) if timer is not None else nullcontext()
+
+    def count(self, key, scope=None):
+        with self.stats_lock:
+            self.stats[key] += 1
+            if scope is not None:
+                scope.stats[key] += 1
+
+    def download_cached(self, request_url, target_path, cache_key, scope=None):
+        """
+        先查资源缓存，命中则直接链接到目标路径；未命中时下载一次写入缓存，同一资源的并发请求只会下载一次
+        """
+        with self.asset_store.key_lock(cache_key):
+            object_path = self.asset_store.lookup(cache_key)
+            if object_path is None:
+                content = self.fetch_with_retry(request_url, scope)
+                if content is None:
+                    return False
+                with self.timed("disk", scope):
+                    object_path = self.asset_store.put(cache_key, content)
+            else:
+                self.count("cache_hits", scope)
+        try:
+            with self.timed("disk", scope):
+                self.asset_store.materialize(object_path, target_path)
+        except OSError:
+            print("附件 {0} 写入失败".format(target_path))
+            return False
+        return True
+
+    def download(self, request_url, target_path, scope=None):
+        content = self.fetch_with_retry(request_url, scope)
+        if content is None:
+            return False
+        try:
+            with self.timed("disk", scope), open(target_path, 'wb') as imageFp:
+                imageFp.write(content)
+                imageFp.flush()
+        except OSError:
+            print("附件 {0} 写入失败".format(target_path))
+            return False
+        return True
+
+    def fetch_with_retry(self, request_url, scope=None):
+        """
+        :return: 资源内容，重试后仍失败时返回 None
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                content = self.fetch(request_url, scope)
+                self.count("downloaded", scope)
+                return content
+            except DownloadError as ex:
+                retryable = ex.retryable
+            except (requests.ConnectionError, requests.Timeout):
+                # 连接超时、连接被重置等网络错误
+                retryable = True
+            except requests.RequestException:
+                # 地址无效、重定向过多等错误重试也不会成功
+                retryable = False
+            if not retryable or attempt == self.retries:
+                print("附件 {0} 下载失败".format(request_url))
+                return None
+            time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        return None
+
+    def fetch(self, request_url, scope=None):
+        with self.host_limit(request_url):
+            self.bucket.acquire()
+            # 只计请求本身，不含等待域名并发名额和令牌的时间
+            with self.timed("network", scope):
+                resp = self.session.get(request_url)
+        if resp.status_code != 200:
+            raise DownloadError("失败链接：{},响应码:{}".format(request_url, resp.status_code),
+                                retryable=resp.status_code in RETRY_STATUS_CODES)
+        return resp.content
+
+
+class DownloadScope:
+    """
+    共享下载池中属于同一个 lakebook 的下载任务。批量并行导出时多个 lakebook 共用一个 ResourceDownloader，
+    每个 lakebook 通过自己的 DownloadScope 提交任务、单独统计下载数和缓存命中数，并且只等待自己的任务结束。
+    用法与 ResourceDownloader 相同：with 块结束时等待任务完成，回调出错时抛出。
+    :param timer: 本 lakebook 的 StageTimer，下载耗时记到这里而不是共享下载池的计时器
+    """
+
+    def __init__(self, downloader, timer=None):
+        self.downloader = downloader
+        self.timer = timer
+        self.stats = {"downloaded": 0, "cache_hits": 0}
+        self.errors = []
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def submit_group(self, resources, on_done):
+        with self.condition:
+            self.pending += 1
+
+        def finish(failed):
+            try:
+                on_done(failed)
+            finally:
+                with self.condition:
+                    self.pending -= 1
+                    self.condition.notify_all()
+
+        self.downloader.submit_group(resources, finish, self)
+
+    def close(self):
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+        if self.errors:
+            raise self.errors[0]
@@ -1,13 +1,21 @@
-from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4 import NavigableString, Tag
+import hashlib
 import json
 from urllib import parse
 import urllib
 import queue
 import os
-import requests
-import time
 import re
 
+from yuque_lakebook_export.lake_dom import parse_html
+
+# 资源占位符：解析时先写入占位符，下载完成后再替换为最终的名称
+RESOURCE_TOKEN = "\ue000{}\ue001"
+RESOURCE_TOKEN_RE = re.compile("\ue000(\\d+)\ue001")
+# 正文中原有的 \ue000 转义为 \ue000\ue002，不会被当成占位符，替换结束后再还原
+RESOURCE_TOKEN_ESCAPE = "\ue000\ue002"
+RESOURCE_FAILURE_NAME = "附件下载失败"
+
 html_text = """
 <div>
     <h1>标题1</h1>
@@ -85,15 +93,111 @@ def build_resource_request_url(data_json):
     ))
 
 
+def build_resource_cache_key(data_json):
+    """
+    资源缓存键：源地址 + 裁剪参数的哈希，同一图片的不同裁剪版本分别缓存
+    """
+    src = data_json.get("src", "")
+    request_url = build_resource_request_url(data_json)
+    crop_hash = ""
+    if request_url != src:
+        crop = [
+            data_json.get("crop"),
+            data_json.get("originWidth") or data_json.get("width"),
+            data_json.get("originHeight") or data_json.get("height"),
+        ]
+        crop_hash = hashlib.sha256(json.dumps(crop).encode("utf-8")).hexdigest()
+    return hashlib.sha256("{}\n{}".format(src, crop_hash).encode("utf-8")).hexdigest()
+
+
 def get_resource_name(src):
     split_result = urllib.parse.urlsplit(src)
     resource_name = os.path.basename(split_result.path)
     return resource_name or "resource"
 
 
+def format_failure(name, image_src):
+    return "[{}]{}".format(name, image_src)
+
+
+def escape_resource_tokens(text):
+    """
+    转义正文中原有的占位符字符（例如从图标字体粘贴进语雀的私用区字符），解析前调用
+    """
+    return text.replace("\ue000", RESOURCE_TOKEN_ESCAPE)
+
+
+def unescape_resource_tokens(text):
+    return text.replace(RESOURCE_TOKEN_ESCAPE, "\ue000")
+
+
+def resolve_resource_tokens(text, pending_resources, failed_indexes):
+    """
+    下载结束后替换资源名称占位符，下载失败的资源名称改为“附件下载失败”，最后还原正文中转义过的占位符字符
+    :param pending_resources: MyContext.pending_resources
+    :param failed_indexes: 下载失败的资源下标集合
+    :return: (替换后的文本, 失败记录列表)
+    """
+    failures = []
+    for index in sorted(failed_indexes):
+        name, request_url = pending_resources[index][:2]
+        failures.append(format_failure(unescape_resource_tokens(name), request_url))
+
+    def replace(match):
+        index = int(match.group(1))
+        if index >= len(pending_resources):
+            return match.group(0)
+        if index in failed_indexes:
+            return RESOURCE_FAILURE_NAME
+        return pending_resources[index][0]
+
+    return unescape_resource_tokens(RESOURCE_TOKEN_RE.sub(replace, text)), failures
+
+
+class DocLinkIndex:
+    """
+    内部文档链接索引：文档标识（uuid、url、doc_id）到导出 Markdown 路径的映射，由 register_doc_paths 预先建立。
+    相对链接按 (所在目录, 目标路径) 缓存，同一目录下的文档反复引用同一篇文档时只计算一次 relpath 和 URL 编码
+    """
+
+    def __init__(self, paths=None):
+        # {文档标识: 导出的 Markdown 路径}
+        self.paths = paths if paths is not None else {}
+        # {(所在目录, 目标路径): 编码后的相对链接}
+        self.relative_links = {}
+
+    def add(self, target_path, *keys):
+        for key in keys:
+            self.paths[key] = target_path
+
+    def get(self, key):
+        return self.paths.get(key)
+
+    def relative_link(self, target_path, current_dir):
+        """
+        :param current_dir: 引用方 Markdown 所在目录，为空时直接使用目标路径
+        :return: 可以写入 Markdown 的相对链接
+        """
+        key = (current_dir, target_path)
+        link = self.relative_links.get(key)
+        if link is None:
+            relative_path = os.path.relpath(target_path, current_dir) if current_dir else target_path
+            link = encode_markdown_path(relative_path.replace(os.path.sep, "/"))
+            self.relative_links[key] = link
+        return link
+
+    def __getstate__(self):
+        # 传给转换进程时不带已缓存的相对链接，各进程按自己处理的文档重新缓存
+        return self.paths
+
+    def __setstate__(self, state):
+        self.paths = state
+        self.relative_links = {}
+
+
 class MyContext:
     def __init__(self, filename="xxx", download_image=True, image_target="", skip_existing=False, current_file_path="",
-                 doc_path_map=None):
+                 link_index=None, session=None):
         self.template_queue = queue.Queue()
         self.result = ""
         # 存放图片的目录
@@ -106,30 +210,117 @@ class MyContext:
         # 是否跳过本地已存在的图片文件
         self.skip_existing = skip_existing
         self.current_file_path = current_file_path
-        self.doc_path_map = doc_path_map or {}
+        self.current_dir = os.path.dirname(current_file_path) if current_file_path else ""
+        self.link_index = link_index if link_index is not None else DocLinkIndex()
+        # 正文引用的其他文档：{文档标识: 解析到的路径或 None}，增量导出据此判断被引用文档改名后是否需要重新转换
+        self.linked_docs = {}
+        # 找不到目标文档的语雀链接：(链接标题, 原链接)
+        self.unresolved_links = []
+        # 共享的 HTTP 会话（PooledSession），由 GlobalContext 传入
+        self.session = session
+        # 待下载资源：(名称, 请求地址, 本地路径, 缓存键)
+        self.pending_resources = []
+        # 整篇文档共用的输出缓冲区，handle_* 把 Markdown 片段追加到这里，最后只拼接一次
+        self.fragments = []
+
+    def take_fragments(self, start):
+        """
+        取出 start 之后写入的片段并拼接，这些片段从缓冲区中移除
+        """
+        text = "".join(self.fragments[start:])
+        del self.fragments[start:]
+        return text
 
     def append_failure(self, name, image_src):
-        r = "[{}]{}".format(name, image_src)
-        self.failure_images.append(r)
+        self.failure_images.append(format_failure(name, image_src))
+
+    def reserve_resource(self, name, request_url, target_path, cache_key=None):
+        """
+        登记一个待下载资源，返回写入 Markdown 的名称占位符
+        """
+        # 名称随 Markdown 一起还原，地址和路径在这里还原
+        self.pending_resources.append((name, unescape_resource_tokens(request_url),
+                                       unescape_resource_tokens(target_path), cache_key))
+        return RESOURCE_TOKEN.format(len(self.pending_resources) - 1)
 
     def find_file_path(self, file_uid):
-        target_path = self.doc_path_map.get(file_uid)
+        target_path = self.link_index.get(file_uid)
+        self.linked_docs[file_uid] = target_path
         if not target_path:
             return file_uid
-        current_dir = os.path.dirname(self.current_file_path) if self.current_file_path else ""
-        if not current_dir:
-            return encode_markdown_path(target_path.replace(os.path.sep, "/"))
-        relative_path = os.path.relpath(target_path, current_dir)
-        return encode_markdown_path(relative_path.replace(os.path.sep, "/"))
+        return self.link_index.relative_link(target_path, self.current_dir)
+
+    def resolve_doc_link(self, candidates):
+        """
+        依次用候选标识查找被引用的文档
+        :return: 第一个找到的文档的相对链接，都找不到时返回 None
+        """
+        for candidate in candidates:
+            target_path = self.link_index.get(candidate)
+            self.linked_docs[candidate] = target_path
+            if target_path:
+                return self.link_index.relative_link(target_path, self.current_dir)
+        return None
 
 
 def eventual_tag(tag: Tag) -> bool:
     return len(tag.contents) == 0 or (len(tag.contents) == 1 and isinstance(tag.contents[0], NavigableString))
 
 
+def ensure_trailing_newline(fragments, start):
+    """
+    start 之后写入的内容非空且不以换行结尾时补一个换行
+    """
+    for index in range(len(fragments) - 1, start - 1, -1):
+        if fragments[index]:
+            if not fragments[index].endswith("\n"):
+                fragments.append("\n")
+            return
+
+
+# 标签名 -> 处理函数 handler(parser, tag, context1)，未注册的标签交给 handle_common。
+# 处理函数把 Markdown 片段写入 context1.fragments；需要转换子标签时返回一个生成器，
+# 依次 yield 子标签，由 handle_descent 的显式栈转换完该子标签后再继续执行生成器
+TAG_HANDLERS = {}
+# 卡片名 -> 处理函数 handler(parser, data_json, context1)，返回卡片的 Markdown，未注册的卡片输出换行
+CARD_HANDLERS = {}
+
+
+def tag_handler(*tag_names):
+    """
+    注册标签处理函数，同名标签以后注册的为准。例如：
+
+        @tag_handler("mark")
+        def handle_mark(parser, tag, context1):
+            return parser.write_wrapped(tag, context1, "==", "==")
+    """
+    def register(handler):
+        for tag_name in tag_names:
+            TAG_HANDLERS[tag_name] = handler
+        return handler
+
+    return register
+
+
+def card_handler(*card_names):
+    """
+    注册卡片处理函数，card_names 为 <card name="..."> 中的 name
+    """
+    def register(handler):
+        for card_name in card_names:
+            CARD_HANDLERS[card_name] = handler
+        return handler
+
+    return register
+
+
 class MyParser:
-    def __init__(self, htmlText):
-        self.soup = BeautifulSoup(htmlText, 'html.parser')
+    def __init__(self, htmlText, parser_backend=None):
+        """
+        :param parser_backend: 解析后端，见 lake_dom.PARSER_BACKENDS，None 等同 auto
+        """
+        self.parser_backend = parser_backend
+        self.soup = parse_html(htmlText, parser_backend)
         self.tagQueue = queue.Queue()
 
     def traverse(self, tag: Tag, deep: int):
@@ -148,148 +339,151 @@ class MyParser:
         print(prefix + tag1.name)
         self.tagQueue.put(tag1)
 
-    def handle_descent(self, tag: Tag, context1: MyContext) -> str:
-        tag_name = tag.name
-        if tag_name == 'span':
-            return self.handle_span(tag, context1)
-        elif tag_name == 'p':
-            return self.handle_p(tag, context1)
-        elif tag_name == 'h1':
-            return self.handle_title(tag, 1, context1)
-        elif tag_name == 'h2':
-            return self.handle_title(tag, 2, context1)
-        elif tag_name == 'h3':
-            return self.handle_title(tag, 3, context1)
-        elif tag_name == 'h4':
-            return self.handle_title(tag, 4, context1)
-        elif tag_name == 'h5':
-            return self.handle_title(tag, 5, context1)
-        elif tag_name == 'h6':
-            return self.handle_title(tag, 6, context1)
-        elif tag_name == 'h7':
-            return self.handle_title(tag, 7, context1)
-        elif tag_name == 'blockquote':
-            return self.handle_blockquote(tag, context1)
-        elif tag_name == 'card':
-            return self.handle_card(tag, context1)
-        elif tag_name == 'strong':
-            return self.handle_strong(tag, context1)
-        elif tag_name == 'em':
-            return self.handle_em(tag, context1)
-        elif tag_name == 'del':
-            return self.handle_del(tag, context1)
-        elif tag_name == 'u':
-            return self.handle_u(tag, context1)
-        elif tag_name == 'sup':
-            return self.handle_sup(tag, context1)
-        elif tag_name == 'sub':
-            return self.handle_sub(tag, context1)
-        elif tag_name == 'code':
-            return self.handle_code(tag, context1)
-        elif tag_name == 'ul':
-            return self.handle_ul(tag, context1)
-        elif tag_name == 'ol':
-            return self.handle_ol(tag, context1)
-        elif tag_name == 'a':
-            return self.handle_a(tag, context1)
-        elif tag_name == 'table':
-            return self.handle_table(tag, context1)
-        else:
-            # print("meet the tag name : " + tag_name)
+    def to_markdown(self, tag: Tag, context1: MyContext) -> str:
+        """
+        把 tag 转换为 Markdown。handle_* 只向 context1.fragments 追加片段，这里统一拼接一次
+        """
+        start = len(context1.fragments)
+        self.handle_descent(tag, context1)
+        return context1.take_fragments(start)
+
+    def handle_descent(self, tag: Tag, context1: MyContext):
+        """
+        用显式栈代替递归转换 tag：栈中是各层标签处理函数返回的生成器，
+        生成器 yield 子标签时压入子标签的处理函数，结束时出栈，嵌套再深也不会触发 RecursionError
+        """
+        stack = []
+        walker = self.start_handler(tag, context1)
+        if walker is not None:
+            stack.append(walker)
+        while stack:
+            try:
+                child = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            walker = self.start_handler(child, context1)
+            if walker is not None:
+                stack.append(walker)
+
+    def start_handler(self, tag: Tag, context1: MyContext):
+        handler = TAG_HANDLERS.get(tag.name)
+        if handler is None:
             return self.handle_common(context1, tag)
+        return handler(self, tag, context1)
 
-    def handle_title(self, tag: Tag, level: int, context1: MyContext):
-        prefix = "#" * level
-        prefix = prefix + " {}\n"
+    def write_wrapped(self, tag: Tag, context1: MyContext, prefix, suffix):
+        """
+        依次写出 prefix、标签内容、suffix。只含文本的标签直接写完返回 None，
+        否则返回遍历子标签的生成器
+        """
+        out = context1.fragments
+        if prefix:
+            out.append(prefix)
         if eventual_tag(tag):
-            if len(tag) == 0:
-                return prefix.format("")
-            return prefix.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return prefix.format(r)
+            if len(tag) != 0:
+                out.append(tag.text)
+            if suffix:
+                out.append(suffix)
+            return None
+        return self.write_children(tag, context1, suffix)
+
+    def write_children(self, tag: Tag, context1: MyContext, suffix):
+        yield from self.handle_common(context1, tag)
+        if suffix:
+            context1.fragments.append(suffix)
+
+    @tag_handler("h1", "h2", "h3", "h4", "h5", "h6", "h7")
+    def handle_heading(self, tag: Tag, context1: MyContext):
+        return self.handle_title(tag, int(tag.name[1:]), context1)
+
+    def handle_title(self, tag: Tag, level: int, context1: MyContext):
+        return self.write_wrapped(tag, context1, "#" * level + " ", "\n")
 
+    @tag_handler("blockquote")
     def handle_blockquote(self, tag: Tag, context1: MyContext):
-        template = "> {}\n"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "> ", "\n")
 
+    @tag_handler("card")
     def handle_card(self, tag: Tag, context1: MyContext):
+        context1.fragments.append(self.card_to_markdown(tag, context1))
+
+    def card_to_markdown(self, tag: Tag, context1: MyContext):
         name = tag.attrs.get("name")
         value = tag.attrs.get("value")
         value = value[5:]
         data = urllib.parse.unquote(value, encoding='utf-8')
         data_json = json.loads(data)
-        if name == 'codeblock':
-            mode = data_json.get('mode')
-            code = data_json.get('code')
-            card_name = data_json.get('name')
-            if not mode:
-                mode = 'plain'
-            if not card_name:
-                card_name = ''
-            f_res = "{0}\n```{1}\n{2}\n```\n".format(card_name, mode, code)
-            return f_res
-        elif name == 'image':
-            card_name = data_json.get('name')
-            card_name, relative_image_path = self.download_resource(context1, data_json, card_name)
-            return "![{}]({})\n".format(card_name, "./" + encode_markdown_path(relative_image_path))
-        elif name == 'hr':
-            return "\n---\n"
-        elif name == 'label':
-            return data_json['label']
-        elif name == 'math':
-            la_tex = data_json['code']
-            card_name, relative_image_path = self.download_resource(context1, data_json, '数学公式')
-            return la_tex + '\n' + "![{}]({})\n".format(card_name, "./" + encode_markdown_path(relative_image_path))
-        elif name == 'file':
-            card_name = data_json.get('name')
-            card_name, relative_image_path = self.download_resource(context1, data_json, card_name)
-            return "![{}]({})\n".format(card_name, "./" + encode_markdown_path(relative_image_path))
-        elif name == 'bookmarklink':
-            detail = data_json.get("detail") or {}
-            title = detail.get("title") or data_json.get("text") or data_json.get("src") or ""
-            url = detail.get("url") or data_json.get("src") or ""
-            if not url:
-                return title + "\n" if title else "\n"
-            return "[{}]({})\n".format(title, url)
-        elif name == 'diagram':
-            return self.handle_diagram_card(data_json)
-        elif name == 'board':
-            return self.handle_board_card(data_json)
-        elif name == 'yuque':
-            src = data_json.get('src')
-            detail = data_json.get("detail") or {}
-            candidates = []
-            if src:
-                candidates.append(src.split("/")[-1].split("?")[0])
-            detail_url = detail.get("url")
-            if detail_url:
-                candidates.append(detail_url.split("/")[-1].split("?")[0])
-            target_doc_id = detail.get("doc_id") or data_json.get("doc_id")
-            if target_doc_id is not None:
-                candidates.append(str(target_doc_id))
-            path = None
-            for candidate in candidates:
-                path = context1.find_file_path(candidate)
-                if path != candidate:
-                    break
-            if not path:
-                path = src or ""
-            title = detail.get("title") or src or "语雀文档"
-            return "[{}]({})".format(title, path)
-
-        else:
+        handler = CARD_HANDLERS.get(name)
+        if handler is None:
             return "\n"
+        return handler(self, data_json, context1)
+
+    @card_handler("codeblock")
+    def handle_codeblock_card(self, data_json, context1: MyContext):
+        mode = data_json.get('mode')
+        code = data_json.get('code')
+        card_name = data_json.get('name')
+        if not mode:
+            mode = 'plain'
+        if not card_name:
+            card_name = ''
+        f_res = "{0}\n```{1}\n{2}\n```\n".format(card_name, mode, code)
+        return f_res
+
+    @card_handler("image", "file")
+    def handle_image_card(self, data_json, context1: MyContext):
+        card_name = data_json.get('name')
+        card_name, relative_image_path = self.download_resource(context1, data_json, card_name)
+        return "![{}]({})\n".format(card_name, "./" + encode_markdown_path(relative_image_path))
+
+    @card_handler("hr")
+    def handle_hr_card(self, data_json, context1: MyContext):
+        return "\n---\n"
+
+    @card_handler("label")
+    def handle_label_card(self, data_json, context1: MyContext):
+        return data_json['label']
+
+    @card_handler("math")
+    def handle_math_card(self, data_json, context1: MyContext):
+        la_tex = data_json['code']
+        card_name, relative_image_path = self.download_resource(context1, data_json, '数学公式')
+        return la_tex + '\n' + "![{}]({})\n".format(card_name, "./" + encode_markdown_path(relative_image_path))
+
+    @card_handler("bookmarklink")
+    def handle_bookmarklink_card(self, data_json, context1: MyContext):
+        detail = data_json.get("detail") or {}
+        title = detail.get("title") or data_json.get("text") or data_json.get("src") or ""
+        url = detail.get("url") or data_json.get("src") or ""
+        if not url:
+            return title + "\n" if title else "\n"
+        return "[{}]({})\n".format(title, url)
+
+    @card_handler("yuque")
+    def handle_yuque_card(self, data_json, context1: MyContext):
+        src = data_json.get('src')
+        detail = data_json.get("detail") or {}
+        candidates = []
+        if src:
+            candidates.append(src.split("/")[-1].split("?")[0])
+        detail_url = detail.get("url")
+        if detail_url:
+            candidates.append(detail_url.split("/")[-1].split("?")[0])
+        target_doc_id = detail.get("doc_id") or data_json.get("doc_id")
+        if target_doc_id is not None:
+            candidates.append(str(target_doc_id))
+        title = detail.get("title") or src or "语雀文档"
+        path = context1.resolve_doc_link(candidates)
+        if path is None:
+            context1.unresolved_links.append((title, src or detail_url or ""))
+            # 找不到时沿用最后一个候选标识，候选标识为空时保留原链接
+            path = (candidates[-1] if candidates else "") or src or ""
+        return "[{}]({})".format(title, path)
 
     def download_resource(self, context1, data_json, name):
         """
-        下载图片
+        计算图片/附件的本地路径并登记下载任务，实际下载由 ResourceDownloader 并发完成
         :param context1:
         :param data_json:
         :param name:
@@ -307,29 +501,18 @@ class MyParser:
             if not os.path.exists(full_image_path):
                 full_image_path = remove_invalid_characters(full_image_path)
                 os.makedirs(full_image_path, exist_ok=True)
-            try:
-                if context1.download_image:
-                    full_image_name = remove_invalid_characters(full_image_name)
-                    # 检查文件是否已存在，如果存在且设置了跳过则跳过下载
-                    if context1.skip_existing and os.path.exists(full_image_name):
-                        print(f"图片已存在，跳过下载: {resource_name}")
-                        return name, relative_image_path
-
-                    time.sleep(0.5)
-                    resp = requests.get(request_url)
-                    if resp.status_code != 200:
-                        raise Exception("失败链接：{},响应码:{}".format(request_url, resp.status_code))
-                    with open(full_image_name, 'wb') as imageFp:
-                        imageFp.write(resp.content)
-                        imageFp.flush()
-            except Exception as ex:
-                # ex.with_traceback()
-                context1.append_failure(name, request_url)
-                print("附件 {0} 下载失败".format(request_url))
-                name = "附件下载失败"
+            if context1.download_image:
+                full_image_name = remove_invalid_characters(full_image_name)
+                # 检查文件是否已存在，如果存在且设置了跳过则跳过下载
+                if context1.skip_existing and os.path.exists(full_image_name):
+                    print(f"图片已存在，跳过下载: {resource_name}")
+                    return name, relative_image_path
+                name = context1.reserve_resource(name, request_url, full_image_name,
+                                                 build_resource_cache_key(data_json))
         return name, relative_image_path
 
-    def handle_diagram_card(self, data_json):
+    @card_handler("diagram")
+    def handle_diagram_card(self, data_json, context1=None):
         diagram_type = data_json.get("type")
         code = data_json.get("code")
         url = data_json.get("url")
@@ -340,7 +523,8 @@ class MyParser:
             return "![{}]({})\n".format(title, url)
         return "\n"
 
-    def handle_board_card(self, data_json):
+    @card_handler("board")
+    def handle_board_card(self, data_json, context1=None):
         diagram_data = data_json.get("diagramData") or {}
         body = diagram_data.get("body") or []
         lines = []
@@ -363,59 +547,42 @@ class MyParser:
             return ""
         if "<" not in html and ">" not in html:
             return html.replace("\u200b", "").strip()
-        text = BeautifulSoup(html, 'html.parser').get_text(" ", strip=True)
+        text = parse_html(html, self.parser_backend).get_text(" ", strip=True)
         text = text.replace("\u200b", "").strip()
         return text
 
+    @tag_handler("span")
     def handle_span(self, tag, context1: MyContext):
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return ""
-            return tag.text
-        else:
-            return self.handle_common(context1, tag)
+        return self.write_wrapped(tag, context1, "", "")
 
+    @tag_handler("p")
     def handle_p(self, tag, context1: MyContext):
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return "\n"
-            return tag.text + "\n"
-        else:
-            return self.handle_common(context1, tag) + "\n"
+        return self.write_wrapped(tag, context1, "", "\n")
 
     def handle_common(self, context1, tag):
-        temp_str = ""
+        """
+        写出标签内的文本，子标签依次 yield 给 handle_descent 转换
+        """
+        out = context1.fragments
         for _tag in tag.contents:
             if isinstance(_tag, NavigableString):
                 text = str(_tag)
                 if not text:
                     continue
-                temp_str = temp_str + text
+                out.append(text)
                 continue
-            temp_str += self.handle_descent(_tag, context1)
-        return temp_str
+            yield _tag
 
+    @tag_handler("strong")
     def handle_strong(self, tag, context1: MyContext):
-        template = "**{}**"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "**", "**")
 
+    @tag_handler("em")
     def handle_em(self, tag, context1: MyContext):
         # 斜体字
-        template = "*{}*"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "*", "*")
 
+    @tag_handler("del")
     def handle_del(self, tag, context1: MyContext):
 
         """
@@ -424,15 +591,9 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "~~{}~~"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "~~", "~~")
 
+    @tag_handler("u")
     def handle_u(self, tag, context1: MyContext):
         """
         下划线
@@ -440,15 +601,9 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "<u>{}</u>"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "<u>", "</u>")
 
+    @tag_handler("sup")
     def handle_sup(self, tag, context1: MyContext):
         """
         上标
@@ -456,15 +611,9 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "^{}"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "^", "")
 
+    @tag_handler("sub")
     def handle_sub(self, tag, context1: MyContext):
         """
         下标
@@ -472,15 +621,9 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "~{}"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "~", "")
 
+    @tag_handler("code")
     def handle_code(self, tag, context1: MyContext):
         """
         将ne-code转换为markdown行内代码格式
@@ -488,15 +631,9 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "`{}`"
-        if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            r = self.handle_common(context1, tag)
-            return template.format(r)
+        return self.write_wrapped(tag, context1, "`", "`")
 
+    @tag_handler("ul")
     def handle_ul(self, tag, context1: MyContext):
         """
         无序列表
@@ -504,28 +641,25 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "- {}\n"
         if eventual_tag(tag):
-            if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text)
-        else:
-            tempStr = ""
-            for _tag in tag.contents:
-                if isinstance(_tag, NavigableString):
-                    tempStr += _tag
-                    continue
-                if _tag.name == 'li':
-                    template1 = "- {}\n"
-                    r = self.handle_common(context1, _tag)
-                    tempStr += template1.format(r)
-                else:
-                    r = self.handle_common(context1, _tag)
-                    tempStr += r
-            if tempStr and not tempStr.endswith("\n"):
-                tempStr += "\n"
-            return tempStr
-
+            # 只含文本，write_wrapped 会直接写完
+            self.write_wrapped(tag, context1, "- ", "\n")
+            return
+        out = context1.fragments
+        start = len(out)
+        for _tag in tag.contents:
+            if isinstance(_tag, NavigableString):
+                out.append(str(_tag))
+                continue
+            if _tag.name == 'li':
+                out.append("- ")
+                yield from self.handle_common(context1, _tag)
+                out.append("\n")
+            else:
+                yield from self.handle_common(context1, _tag)
+        ensure_trailing_newline(out, start)
+
+    @tag_handler("ol")
     def handle_ol(self, tag, context1: MyContext):
         """
         有序列表
@@ -533,30 +667,29 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "1. {}"
+        out = context1.fragments
         if eventual_tag(tag):
             if len(tag) == 0:
-                return template.format("")
-            return template.format(tag.text) + "\n"
-        else:
-            tempStr = ""
-            count = 1
-            for _tag in tag.contents:
-                if isinstance(_tag, NavigableString):
-                    tempStr += _tag
-                    continue
-                if _tag.name == 'li':
-                    template1 = "{}. {}\n"
-                    r = self.handle_common(context1, _tag)
-                    tempStr += template1.format(count, r)
-                    count += 1
-                else:
-                    r = self.handle_common(context1, _tag)
-                    tempStr += r
-            if tempStr and not tempStr.endswith("\n"):
-                tempStr += "\n"
-            return tempStr
-
+                out.append("1. ")
+            else:
+                out.append("1. {}\n".format(tag.text))
+            return
+        start = len(out)
+        count = 1
+        for _tag in tag.contents:
+            if isinstance(_tag, NavigableString):
+                out.append(str(_tag))
+                continue
+            if _tag.name == 'li':
+                out.append("{}. ".format(count))
+                yield from self.handle_common(context1, _tag)
+                out.append("\n")
+                count += 1
+            else:
+                yield from self.handle_common(context1, _tag)
+        ensure_trailing_newline(out, start)
+
+    @tag_handler("a")
     def handle_a(self, tag, context1: MyContext):
         """
         链接
@@ -564,27 +697,29 @@ class MyParser:
         :param tag:
         :return:
         """
-        template = "[{}]({})"
+        out = context1.fragments
         if eventual_tag(tag):
             if len(tag) == 0:
-                return template.format("temp", "temp")
-            return template.format(tag.text, tag.attrs.get("href"))
-        else:
-            href = tag.attrs.get("href")
-            r = self.handle_common(context1, tag)
-            return template.format(r, href)
+                out.append("[temp](temp)")
+                return
+            out.append("[{}]({})".format(tag.text, tag.attrs.get("href")))
+            return
+        out.append("[")
+        yield from self.handle_common(context1, tag)
+        out.append("]({})".format(tag.attrs.get("href")))
 
+    @tag_handler("table")
     def handle_table(self, tag, context1: MyContext):
         """
-        表格
+        表格。单元格内容要把换行替换为空格，所以先写入缓冲区再取回处理
         :param context1:
         :param tag:
         :return:
         """
+        out = context1.fragments
         tbody: Tag = tag.tbody
         # if not tbody:
         #     return self.handle_common(context1, tag)
-        table_str = ""
         row_count = 0
         col_num = 0
         for _tr in tbody.contents:
@@ -592,16 +727,13 @@ class MyParser:
             for _td in _tr.contents:
                 if row_count == 0:
                     col_num += 1
-                r = self.handle_common(context1, _td)
-                r = r.replace("\n", " ").strip()
-                cells.append(r)
-            row = "| " + " | ".join(cells) + " |\n"
-            table_str += row
+                start = len(out)
+                yield from self.handle_common(context1, _td)
+                cells.append(context1.take_fragments(start).replace("\n", " ").strip())
+            out.append("| " + " | ".join(cells) + " |\n")
             if row_count == 0:
-                separate = "| " + " | ".join(["---" for _ in range(0, col_num)]) + " |\n"
-                table_str += separate
+                out.append("| " + " | ".join(["---" for _ in range(0, col_num)]) + " |\n")
             row_count += 1
-        return table_str
 
     #
 
@@ -614,7 +746,7 @@ if __name__ == '__main__':
     # my = MyParser("".join(allText))
     # my.traverse(my.soup, 0)
     context = MyContext()
-    res = my.handle_descent(my.soup, context)
+    res = my.to_markdown(my.soup, context)
     # content = "\n".join(context.result)
     print(res)
     f = open('../html_test/lake_data_t.md', 'w', encoding='utf-8')
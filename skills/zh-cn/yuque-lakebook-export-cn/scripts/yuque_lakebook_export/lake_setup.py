@@ -1,13 +1,33 @@
 import json
 import re
+import threading
+import time
 import traceback
 
-import yaml
 import os
-import shutil
-import tempfile
-from yuque_lakebook_export.lake_handle import MyParser, MyContext, remove_invalid_characters, sanitize_path_segment
-from yuque_lakebook_export.lake_reader import unpack_lake_book_file
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from yuque_lakebook_export.lake_dom import resolve_parser_backend
+from yuque_lakebook_export.lake_download import (
+    AssetStore,
+    DownloadScope,
+    ResourceDownloader,
+    diff_session_stats,
+    get_shared_session,
+)
+from yuque_lakebook_export.lake_handle import (
+    DocLinkIndex,
+    MyContext,
+    MyParser,
+    escape_resource_tokens,
+    remove_invalid_characters,
+    resolve_resource_tokens,
+    sanitize_path_segment,
+)
+from yuque_lakebook_export.lake_manifest import ExportManifest, source_hash
+from yuque_lakebook_export.lake_reader import LakeBookArchive, LakeBookDirectory, TocCache, load_toc_yaml
+from yuque_lakebook_export.lake_timing import StageTimer, format_stages
 
 
 class GlobalContext:
@@ -26,7 +46,40 @@ class GlobalContext:
         self.download_image = True
         self.skip_existing = False
         self.root_path = ""
-        self.doc_path_map = {}
+        # 读取 $meta.json 和文档 json 的来源（LakeBookArchive 或 LakeBookDirectory）
+        self.source = None
+        # 内部文档链接索引（DocLinkIndex），由 register_doc_paths 建立
+        self.link_index = DocLinkIndex()
+        # 找不到目标文档的语雀链接，见 record_unresolved_links
+        self.unresolved_links = []
+        # 资源下载池参数（并发数、单域名并发、限速、重试），见 ResourceDownloader
+        self.download_options = {}
+        self.downloader = None
+        # 进程内共享的 HTTP 会话（PooledSession）
+        self.session = None
+        # 跨文档/跨运行的资源缓存（AssetStore），为 None 时不缓存
+        self.asset_store = None
+        self.download_stats = {}
+        # 并行转换文档的进程数，1 表示在主进程中顺序转换
+        self.workers = 1
+        # 正文解析后端，见 lake_dom.PARSER_BACKENDS
+        self.parser_backend = None
+        # 增量导出清单（ExportManifest），为 None 时全部重新转换
+        self.manifest = None
+        # 下载线程写出文档后修改失败列表和增量清单时使用
+        self.lock = threading.Lock()
+        # 目录树中的目录节点，增量导出清理空目录时保留
+        self.tree_dirs = set()
+        # 批量并行导出时所有 lakebook 共用的下载池、转换进程池和汇总进度（BatchProgress）
+        self.shared_downloader = None
+        self.convert_pool = None
+        self.progress = None
+        # 共享转换进程池中标识本 lakebook 的参数，见 book_worker_context
+        self.worker_book = None
+        # 分阶段计时和计数，见 lake_timing.StageTimer
+        self.timer = StageTimer()
+        # 解析后的目录缓存（TocCache），为 None 时每次都解析 tocYml
+        self.toc_cache = None
 
 
 HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s+')
@@ -58,9 +111,38 @@ def strip_lake_prefix_artifact(text):
     return normalized
 
 
+LINE_BLANK = "blank"
+LINE_TEXT = "text"
+LINE_HEADING = "heading"
+LINE_HR = "hr"
+LINE_FENCE = "fence"
+LINE_TABLE = "table"
+
+
+def classify_line(line):
+    """
+    判断一行（已去掉行尾空白）的块类型，先看首个非空白字符，只在可能命中时才跑对应的正则
+    :return: LINE_* 之一
+    """
+    content = line.lstrip()
+    if not content:
+        return LINE_BLANK
+    marker = content[0]
+    if marker == "#":
+        return LINE_HEADING if HEADING_RE.match(line) else LINE_TEXT
+    if marker in "-*_":
+        return LINE_HR if HR_RE.match(line) else LINE_TEXT
+    if marker == "|":
+        return LINE_TABLE if TABLE_ROW_RE.match(line) else LINE_TEXT
+    if content.startswith("```") or content.startswith("~~~"):
+        return LINE_FENCE
+    return LINE_TEXT
+
+
 def normalize_markdown(text):
     """
     统一整理块级元素之间的空行，提升 Obsidian 等 Markdown 渲染兼容性。
+    逐行单遍处理：每行只分类一次，只记录上一个非空行的类型，输出时直接合并连续空行。
     """
     text = strip_lake_prefix_artifact(text)
     lines = text.splitlines()
@@ -69,125 +151,101 @@ def normalize_markdown(text):
 
     normalized = []
     in_fence = False
+    # 上一个非空行的类型，None 表示还没有非空行
+    prev_kind = None
+    last_blank = False
+
+    def emit(value, blank):
+        nonlocal last_blank
+        if blank and last_blank:
+            return
+        normalized.append(value)
+        last_blank = blank
+
+    stripped = lines[0].rstrip()
+    kind = classify_line(stripped)
+    for index in range(len(lines)):
+        if index + 1 < len(lines):
+            next_stripped = lines[index + 1].rstrip()
+            next_kind = classify_line(next_stripped)
+        else:
+            next_stripped, next_kind = "", LINE_BLANK
 
-    def is_blank(value):
-        return value.strip() == ""
-
-    def is_fence(value):
-        stripped = value.strip()
-        return stripped.startswith("```") or stripped.startswith("~~~")
-
-    def is_heading(value):
-        return bool(HEADING_RE.match(value))
-
-    def is_hr(value):
-        return bool(HR_RE.match(value))
+        if not in_fence and normalized and not last_blank:
+            if kind in (LINE_HEADING, LINE_HR, LINE_FENCE):
+                if prev_kind is not None:
+                    emit("", True)
+            elif kind == LINE_TABLE and prev_kind is not None and prev_kind != LINE_TABLE:
+                emit("", True)
 
-    def is_table_row(value):
-        return bool(TABLE_ROW_RE.match(value))
+        emit(stripped, kind == LINE_BLANK)
+        if kind != LINE_BLANK:
+            prev_kind = kind
 
-    def previous_nonblank():
-        for item in reversed(normalized):
-            if not is_blank(item):
-                return item
-        return None
-
-    for index, line in enumerate(lines):
-        stripped = line.rstrip()
-        next_line = lines[index + 1] if index + 1 < len(lines) else ""
-        prev = previous_nonblank()
-        current_is_fence = is_fence(stripped)
-        current_is_heading = is_heading(stripped)
-        current_is_hr = is_hr(stripped)
-        current_is_table = is_table_row(stripped)
-        next_is_table = is_table_row(next_line)
-
-        if not in_fence:
-            should_prepend_blank = False
-            if current_is_heading or current_is_hr or current_is_fence:
-                should_prepend_blank = prev is not None
-            elif current_is_table and prev is not None and not is_table_row(prev):
-                should_prepend_blank = True
-
-            if should_prepend_blank and normalized and not is_blank(normalized[-1]):
-                normalized.append("")
-
-        normalized.append(stripped)
-
-        if current_is_fence:
+        if kind == LINE_FENCE:
             in_fence = not in_fence
-            if not in_fence and next_line and next_line.strip() and not is_blank(next_line):
-                if not is_blank(normalized[-1]):
-                    normalized.append("")
-            continue
+            if not in_fence and next_kind != LINE_BLANK:
+                emit("", True)
+        elif not in_fence and next_kind != LINE_BLANK:
+            if kind == LINE_TABLE and next_kind != LINE_TABLE:
+                emit("", True)
+            elif kind in (LINE_HEADING, LINE_HR):
+                emit("", True)
 
-        if in_fence:
-            continue
+        stripped, kind = next_stripped, next_kind
 
-        if current_is_table and not next_is_table:
-            if next_line and next_line.strip():
-                normalized.append("")
-        elif (current_is_heading or current_is_hr) and next_line and next_line.strip():
-            normalized.append("")
-
-    collapsed = []
-    blank_count = 0
-    for line in normalized:
-        if is_blank(line):
-            blank_count += 1
-            if blank_count > 1:
-                continue
-        else:
-            blank_count = 0
-        collapsed.append(line)
-
-    result = "\n".join(collapsed).strip() + "\n"
-    return result
+    return "\n".join(normalized).strip() + "\n"
 
 
 # from lxml import etree
 def load_meta_json(global_context: GlobalContext):
     """
-    解析meta.json中标注的文件关系
+    解析meta.json中标注的文件关系。设置了 toc_cache 时按 $meta.json 的哈希缓存整理好的目录
     :return:
     """
-    full_path = "/".join([global_context.root_path, "$meta.json"])
-    fp = open(full_path, 'r', encoding='utf-8')
-    json_obj = json.load(fp)
-    meta = json_obj['meta']
-    # print(meta)
-    meta_obj = json.loads(meta)
-    book_yml = meta_obj['book']['tocYml']
-    # print(book_yml)
-    # with open('meta_book_yml.yaml', 'w+', encoding='utf-8') as yaml_fp:
-    #     yaml_fp.write(book_yml)
-    #     yaml_fp.flush()
-    books = yaml.load(book_yml, yaml.Loader)
+    meta_bytes = global_context.source.read_bytes("$meta.json")
+    toc_cache = global_context.toc_cache
+    cache_key = toc_cache.key(meta_bytes) if toc_cache is not None else None
+    toc = toc_cache.get(cache_key) if toc_cache is not None else None
+    if toc is None:
+        json_obj = json.loads(meta_bytes)
+        meta = json_obj['meta']
+        meta_obj = json.loads(meta)
+        book_yml = meta_obj['book']['tocYml']
+        toc = build_toc(load_toc_yaml(book_yml))
+        if toc_cache is not None:
+            toc_cache.put(cache_key, toc)
+    global_context.root_books, global_context.parent_id_and_child, global_context.id_and_book = toc
+    global_context.file_total = len(global_context.id_and_book)
+    global_context.total = len(global_context.id_and_book)
+
+
+def build_toc(books):
+    """
+    把目录条目整理为 (根节点列表, {parent_uuid: 子节点列表}, {uuid: 节点})
+    """
+    root_books = []
+    parent_id_and_child = {}
+    id_and_book = {}
     for book in books:
         if book.get('uuid'):
-            global_context.id_and_book[book['uuid']] = book
+            id_and_book[book['uuid']] = book
         if book['type'] == 'META':
             continue
         if book['parent_uuid'] == '':
-            global_context.root_books.append(book)
+            root_books.append(book)
             continue
-        parent_uuid = book['parent_uuid']
-        if global_context.parent_id_and_child.get(parent_uuid):
-            global_context.parent_id_and_child[parent_uuid].append(book)
-        else:
-            global_context.parent_id_and_child[parent_uuid] = []
-            global_context.parent_id_and_child[parent_uuid].append(book)
-    # print(books)
-    global_context.file_total = len(global_context.id_and_book)
-    global_context.total = len(global_context.id_and_book)
+        parent_id_and_child.setdefault(book['parent_uuid'], []).append(book)
+    return root_books, parent_id_and_child, id_and_book
 
 
-def create_tree_dir(global_context, parent_dir, book):
+def create_tree_dir(global_context, parent_dir, book, work_list):
     """
-    根据解析出的关系创建文档的目录树
+    根据解析出的关系创建文档的目录树，并把需要转换的文档按目录顺序展开到 work_list
     :param parent_dir: 当前文档所在的父目录
     :param book: 当前book对象
     :param global_context 上下文
+    :param work_list: [(文档 json 文件名, 导出目标路径(不含 .md)), ...]
     :return:
     """
     if book is None:
@@ -203,31 +261,192 @@ def create_tree_dir(global_context, parent_dir, book):
         current_dir = remove_invalid_characters(os.path.join(parent_dir, name))
         if not os.path.exists(current_dir):
             os.makedirs(current_dir, exist_ok=True)
+        global_context.tree_dirs.add(os.path.abspath(current_dir))
 
     global_context.all_file_count += 1
     if file_url != '':
-        ltm = LakeToMd(
-            os.path.join(global_context.root_path, "{}.json".format(file_url)),
-            target=os.path.join(current_dir if has_children else parent_dir, name)
-        )
-        ltm.to_md(global_context)
-        global_context.failure_image_download_list += ltm.image_download_failure
-        global_context.file_count += 1
-        # print("\r", end="")
-        # i = (file_count // file_total) * 100
-        print("\rprocess progress: {}/{}/{}. ".format(global_context.file_count, global_context.all_file_count,
-                                                      global_context.file_total), end="")
-        # sys.stdout.flush()
-        # time.sleep(0.05)
+        work_list.append((
+            "{}.json".format(file_url),
+            os.path.join(current_dir if has_children else parent_dir, name),
+            uuid
+        ))
     if not book_children:
         return
     for child in book_children:
-        create_tree_dir(global_context, current_dir, child)
+        create_tree_dir(global_context, current_dir, child, work_list)
+
+
+def print_progress(global_context):
+    global_context.file_count += 1
+    if global_context.progress is not None:
+        global_context.progress.advance()
+        return
+    print("\rprocess progress: {}/{}/{}. ".format(global_context.file_count, global_context.all_file_count,
+                                                  global_context.file_total), end="")
+
+
+_worker_context = None
+
+
+def init_convert_worker(source, link_index, download_image, skip_existing, parser_backend=None):
+    """
+    转换进程的初始化函数：每个进程只接收一次文档来源、链接索引等只读配置
+    """
+    global _worker_context
+    _worker_context = GlobalContext()
+    _worker_context.source = source
+    _worker_context.link_index = link_index
+    _worker_context.download_image = download_image
+    _worker_context.skip_existing = skip_existing
+    _worker_context.parser_backend = parser_backend
+
+
+def render_task(context, task):
+    """
+    在转换进程中解析单篇文档，只返回 Markdown、待下载资源、引用的文档、未解析的链接和本篇的阶段耗时，
+    下载与写文件由主进程完成
+    """
+    filename, target, uuid = task
+    context.timer = StageTimer()
+    with context.timer.stage("read"):
+        ltm = LakeToMd(filename, target=target, source=context.source)
+    pending_resources = ltm.render(context)
+    return (uuid, ltm.target, ltm.markdown, pending_resources, ltm.linked_docs, ltm.unresolved_links,
+            context.timer.snapshot())
+
+
+def render_document_in_worker(task):
+    return render_task(_worker_context, task)
+
+
+# 共享转换进程池中每个进程缓存的 lakebook 上下文，按最近使用排序
+_worker_books = OrderedDict()
+_worker_books_limit = 1
+
+
+def init_book_worker(limit):
+    """
+    共享转换进程池的初始化函数：同时处理的 lakebook 不超过 limit 本，每个进程最多缓存这么多本书的上下文
+    """
+    global _worker_books_limit
+    _worker_books_limit = max(1, limit)
+
+
+def book_worker_context(book):
+    """
+    共享转换进程池中的进程会处理多个 lakebook 的文档，首次遇到某个 lakebook 时
+    从 lakebook 重新读取目录树、计算文档路径表，之后按 book 缓存，任务本身只携带这组很小的参数。
+    缓存超过 _worker_books_limit 本时关闭最久未用的 lakebook（文件句柄和 mmap），之后再遇到会重新打开
+    :param book: (lakebook 路径, meta 目录, 导出根目录, 是否下载图片, 是否跳过已存在资源, 解析后端, 目录缓存目录)
+    """
+    context = _worker_books.get(book)
+    if context is not None:
+        _worker_books.move_to_end(book)
+        return context
+    lake_book, meta, output_path, download_image, skip_existing, parser_backend, toc_cache_dir = book
+    context = GlobalContext()
+    context.source = LakeBookArchive(lake_book) if lake_book else LakeBookDirectory(meta)
+    # 主进程已解析过目录并写入缓存，这里通常直接命中
+    context.toc_cache = TocCache(toc_cache_dir) if toc_cache_dir else None
+    context.download_image = download_image
+    context.skip_existing = skip_existing
+    context.parser_backend = parser_backend
+    load_meta_json(context)
+    for root_book in context.root_books:
+        register_doc_paths(context, output_path, root_book)
+    _worker_books[book] = context
+    while len(_worker_books) > _worker_books_limit:
+        _, evicted = _worker_books.popitem(last=False)
+        evicted.source.close()
+    return context
+
+
+def render_book_document_in_worker(book, task):
+    """
+    在共享转换进程池中解析单篇文档，返回值与 render_document_in_worker 相同
+    """
+    return render_task(book_worker_context(book), task)
+
+
+def document_recorder(global_context, uuid, target, linked_docs, unresolved_links=()):
+    """
+    增量导出时返回写出文档后把它记入清单的回调，否则返回 None
+    """
+    manifest = global_context.manifest
+    if manifest is None:
+        return None
+
+    def record(failures):
+        manifest.record(uuid, target + ".md", linked_docs, failures, unresolved_links)
+
+    return record
+
+
+def record_unresolved_links(global_context, target, unresolved_links):
+    """
+    汇总一篇文档中找不到目标文档的语雀链接，导出结束后统一输出
+    """
+    md_path = target if target.endswith(".md") else target + ".md"
+    for title, src in unresolved_links:
+        global_context.unresolved_links.append({"doc": md_path, "title": title, "src": src})
+
+
+def plan_incremental(global_context, work_list):
+    """
+    按清单移动改名的文档、删除已移除的文档，只保留来源或引用路径有变化的文档
+    """
+    manifest = global_context.manifest
+    documents = [(uuid, remove_invalid_characters(target) + ".md",
+                  source_hash(global_context.source.read_bytes(filename)))
+                 for filename, target, uuid in work_list]
+    to_convert = manifest.plan(documents, global_context.link_index.paths, global_context.tree_dirs)
+    return [task for task in work_list if task[2] in to_convert]
+
+
+def convert_documents(global_context, work_list):
+    """
+    转换展开后的文档列表。workers > 1 时用进程池并行解析，失败列表和进度仍在主进程汇总
+    """
+    if global_context.progress is not None:
+        global_context.progress.add_total(len(work_list))
+    if global_context.workers <= 1 or len(work_list) <= 1:
+        for filename, target, uuid in work_list:
+            with global_context.timer.stage("read"):
+                ltm = LakeToMd(filename, target=target, source=global_context.source)
+            ltm.to_md(global_context, uuid)
+            print_progress(global_context)
+        return
+
+    chunksize = max(1, min(16, len(work_list) // (global_context.workers * 8)))
+    if global_context.convert_pool is not None:
+        results = global_context.convert_pool.map(render_book_document_in_worker, repeat(global_context.worker_book),
+                                                  work_list, chunksize=chunksize)
+        for uuid, target, markdown, pending_resources, linked_docs, unresolved_links, timings in results:
+            global_context.timer.merge(timings)
+            record_unresolved_links(global_context, target, unresolved_links)
+            recorder = document_recorder(global_context, uuid, target, linked_docs, unresolved_links)
+            write_document(global_context, target, markdown, pending_resources, on_written=recorder)
+            print_progress(global_context)
+        return
+
+    with ProcessPoolExecutor(
+            max_workers=global_context.workers,
+            initializer=init_convert_worker,
+            initargs=(global_context.source, global_context.link_index, global_context.download_image,
+                      global_context.skip_existing, global_context.parser_backend)
+    ) as pool:
+        for uuid, target, markdown, pending_resources, linked_docs, unresolved_links, timings in pool.map(
+                render_document_in_worker, work_list, chunksize=chunksize):
+            global_context.timer.merge(timings)
+            record_unresolved_links(global_context, target, unresolved_links)
+            recorder = document_recorder(global_context, uuid, target, linked_docs, unresolved_links)
+            write_document(global_context, target, markdown, pending_resources, on_written=recorder)
+            print_progress(global_context)
 
 
 def register_doc_paths(global_context, parent_dir, book):
     """
-    预先计算所有导出 markdown 路径，供内部文档链接转相对路径使用。
+    预先计算所有导出 markdown 路径，建立内部文档链接索引，供内部文档链接转相对路径使用。
     """
     if book is None:
         return
@@ -244,10 +463,9 @@ def register_doc_paths(global_context, parent_dir, book):
     if file_url != '':
         target_base = os.path.join(current_dir if has_children else parent_dir, name)
         target_md_path = remove_invalid_characters(target_base) + ".md"
-        global_context.doc_path_map[uuid] = target_md_path
-        global_context.doc_path_map[file_url] = target_md_path
+        global_context.link_index.add(target_md_path, uuid, file_url)
         if book.get('doc_id') is not None:
-            global_context.doc_path_map[str(book['doc_id'])] = target_md_path
+            global_context.link_index.add(target_md_path, str(book['doc_id']))
 
     if not book_children:
         return
@@ -257,17 +475,30 @@ def register_doc_paths(global_context, parent_dir, book):
 
 class LakeToMd:
     body_html = None
-    image_download_failure = []
+    markdown = ""
 
-    def __init__(self, filename, target):
+    def __init__(self, filename, target, source=None):
+        """
+        :param filename: 文档 json 路径；指定 source 时为 lakebook 内的文件名
+        :param target: 导出目标路径（不含 .md）
+        :param source: LakeBookArchive 或 LakeBookDirectory
+        """
         self.filename = filename
         self.target = target
+        self.source = source
+        self.image_download_failure = []
+        # 正文引用的其他文档：{文档标识: 解析到的路径或 None}
+        self.linked_docs = {}
+        # 找不到目标文档的语雀链接：(链接标题, 原链接)
+        self.unresolved_links = []
         self.__body_html()
 
     def __body_html(self):
-        fp = open(file=self.filename, mode='r', encoding='utf-8')
-        file_json = json.load(fp)
-        fp.close()
+        if self.source is not None:
+            file_json = self.source.read_json(self.filename)
+        else:
+            with open(file=self.filename, mode='r', encoding='utf-8') as fp:
+                file_json = json.load(fp)
         self.body_html = self._extract_body(file_json)
 
     @staticmethod
@@ -293,8 +524,14 @@ class LakeToMd:
         """
         return strip_lake_prefix_artifact(body)
 
-    def to_md(self, global_context):
-        mp = MyParser(self.body_html)
+    def render(self, global_context):
+        """
+        解析正文为 Markdown，保存到 self.markdown
+        :return: 待下载资源列表，名称以占位符形式写在 Markdown 中
+        """
+        timer = global_context.timer
+        with timer.stage("parse"):
+            mp = MyParser(escape_resource_tokens(self.body_html), global_context.parser_backend)
         name = os.path.basename(self.target)
         short_target = os.path.dirname(self.target)
         current_file_path = remove_invalid_characters(self.target) + ".md"
@@ -306,29 +543,100 @@ class LakeToMd:
             download_image=global_context.download_image,
             skip_existing=global_context.skip_existing,
             current_file_path=current_file_path,
-            doc_path_map=global_context.doc_path_map
+            link_index=global_context.link_index,
+            session=global_context.session
         )
-        res = mp.handle_descent(mp.soup, context)
-        res = normalize_markdown(res)
-        self.image_download_failure += context.failure_images
+        with timer.stage("emit"):
+            res = mp.to_markdown(mp.soup, context)
+        with timer.stage("normalize"):
+            self.markdown = normalize_markdown(res)
+        self.linked_docs = context.linked_docs
+        self.unresolved_links = context.unresolved_links
+        timer.count("docs")
+        timer.count("html_chars", len(self.body_html))
+        timer.count("markdown_chars", len(self.markdown))
+        timer.count("resources", len(context.pending_resources))
         self.target = remove_invalid_characters(self.target)
-        if not res.strip():
+        if not self.markdown.strip():
             print(f"\n警告: 文档导出结果为空 -> {self.filename}")
-        with open(self.target + ".md", 'w+', encoding='utf-8') as fp:
-            fp.writelines(res)
-            fp.flush()
+        return context.pending_resources
+
+    def to_md(self, global_context, uuid=None):
+        pending_resources = self.render(global_context)
+        record_unresolved_links(global_context, self.target, self.unresolved_links)
+        write_document(global_context, self.target, self.markdown, pending_resources, self.image_download_failure,
+                       document_recorder(global_context, uuid, self.target, self.linked_docs, self.unresolved_links))
+
+
+def write_document(global_context, target, markdown, pending_resources, failure_sink=None, on_written=None):
+    """
+    提交文档的资源下载，全部结束后替换资源名称占位符并写出 target.md
+    :param failure_sink: 额外接收本文档下载失败记录的列表
+    :param on_written: 写出后在 global_context.lock 内调用，参数为本文档的下载失败记录
+    """
+    # 同一文档中重复引用的资源只下载一次
+    unique_resources = {}
+    resource_slots = []
+    for _, request_url, target_path, cache_key in pending_resources:
+        resource_slots.append(unique_resources.setdefault((request_url, target_path, cache_key),
+                                                          len(unique_resources)))
+
+    def write_markdown(failed_slots):
+        with global_context.timer.stage("write"):
+            failed_indexes = {index for index, slot in enumerate(resource_slots) if slot in failed_slots}
+            text, failures = resolve_resource_tokens(markdown, pending_resources, failed_indexes)
+            with open(target + ".md", 'w+', encoding='utf-8') as fp:
+                fp.writelines(text)
+                fp.flush()
+        # 在下载线程中执行，多篇文档同时完成时通过 global_context.lock 修改共享的失败列表和清单
+        with global_context.lock:
+            if failure_sink is not None:
+                failure_sink.extend(failures)
+            global_context.failure_image_download_list += failures
+            if on_written is not None:
+                on_written(failures)
+
+    if global_context.downloader is None:
+        with ResourceDownloader(session=global_context.session, asset_store=global_context.asset_store,
+                                timer=global_context.timer, **global_context.download_options) as downloader:
+            downloader.submit_group(list(unique_resources), write_markdown)
+        return
+    global_context.downloader.submit_group(list(unique_resources), write_markdown)
 
 
 def convert_to_md(global_context, file_path, open_output=False):
     output_path = file_path
     if not os.path.exists(output_path):
         os.makedirs(output_path, exist_ok=True)
-    global_context.doc_path_map = {}
+    global_context.link_index = DocLinkIndex()
     for root_book in global_context.root_books:
         register_doc_paths(global_context, output_path, root_book)
-    for root_book in global_context.root_books:
-        create_tree_dir(global_context, output_path, root_book)
-    print("\n>>> markdown 转换完成")
+    if global_context.shared_downloader is not None:
+        downloader = DownloadScope(global_context.shared_downloader, timer=global_context.timer)
+    else:
+        downloader = ResourceDownloader(session=global_context.session, asset_store=global_context.asset_store,
+                                        timer=global_context.timer, **global_context.download_options)
+    with downloader:
+        global_context.downloader = downloader
+        work_list = []
+        for root_book in global_context.root_books:
+            create_tree_dir(global_context, output_path, root_book, work_list)
+        if global_context.manifest is not None:
+            global_context.manifest.load()
+            work_list = plan_incremental(global_context, work_list)
+            stats = global_context.manifest.stats
+            print(">>> 增量导出: 转换 {converted}，移动 {moved}，未变化 {unchanged}，删除 {deleted}".format(**stats))
+            for md_path, unresolved_links in global_context.manifest.unchanged_unresolved_links():
+                record_unresolved_links(global_context, md_path, unresolved_links)
+        convert_documents(global_context, work_list)
+        print("\n>>> 等待资源下载完成")
+        wait_started = time.perf_counter()
+    global_context.timer.add("wait", time.perf_counter() - wait_started)
+    global_context.downloader = None
+    if global_context.manifest is not None:
+        global_context.manifest.save()
+    global_context.download_stats = dict(downloader.stats)
+    print(">>> markdown 转换完成")
     if open_output:
         # 根据操作系统选择合适的命令打开文件夹
         import platform
@@ -343,31 +651,77 @@ def convert_to_md(global_context, file_path, open_output=False):
             print("未识别的操作系统，无法自动打开输出文件夹")
 
 
-def start_convert(meta, lake_book, output, download_image_of_in, skip_existing=False, open_output=False):
+def start_convert(meta, lake_book, output, download_image_of_in, skip_existing=False, open_output=False,
+                  download_options=None, session_options=None, asset_cache_dir=None, workers=1, parser_backend=None,
+                  incremental=False, shared_downloader=None, convert_pool=None, progress=None, toc_cache_dir=None,
+                  link_assets=False):
+    """
+    :param link_assets: .assets 中的资源用硬链接指向资源缓存而不是复制
+    :param toc_cache_dir: 解析后的目录缓存目录（TocCache），同一本书再次导出时跳过 tocYml 解析；为 None 时不缓存
+    :param incremental: 增量导出，按输出目录中的清单只转换新增或变化的文档，移动改名的文档并删除已移除的文档
+    :param shared_downloader: 批量并行导出时共用的 ResourceDownloader，见 start_parallel_convert
+    :param convert_pool: 批量并行导出时共用的转换进程池
+    :param progress: 批量并行导出时的汇总进度（BatchProgress），逐篇进度不再单独打印
+    """
+    started_at = time.perf_counter()
     global_context = GlobalContext()
-    temp_dir = tempfile.mkdtemp(prefix="yuque_export_")
+    global_context.workers = max(1, workers or 1)
+    if asset_cache_dir and shared_downloader is None:
+        # 共用下载池时资源缓存由下载池持有，这里不再为同一目录另建一个
+        global_context.asset_store = AssetStore(asset_cache_dir, link=link_assets)
+    if toc_cache_dir:
+        global_context.toc_cache = TocCache(toc_cache_dir)
+    global_context.download_options = dict(download_options or {})
+    global_context.session = get_shared_session(**(session_options or {}))
+    global_context.shared_downloader = shared_downloader
+    global_context.convert_pool = convert_pool
+    global_context.progress = progress
+    session_stats_before = global_context.session.stats()
     result = {
         "success": False,
         "file_count": 0,
         "output": os.path.abspath(output) if output else output,
         "error": None,
-        "failure_images": []
+        "failure_images": [],
+        "http_stats": {},
+        "download_stats": {},
+        "incremental": {},
+        "unresolved_links": [],
+        "elapsed": 0,
+        "timings": {}
     }
     if lake_book:
-        global_context.root_path = unpack_lake_book_file(lake_book, temp_dir)
-        print(">>> lake文件抽取完成")
+        # 直接从 lakebook 中按需读取，不再解压到临时目录
+        global_context.root_path = lake_book
+        global_context.source = LakeBookArchive(lake_book)
     else:
         global_context.root_path = meta
+        global_context.source = LakeBookDirectory(meta)
     if not global_context.root_path:
         print("参数校验失败！-i或者-l二者必须有一个")
         result["error"] = "参数校验失败！-i或者-l二者必须有一个"
         return result
     try:
-        load_meta_json(global_context)
+        if lake_book:
+            # 在 try 内建立索引：损坏的 lakebook 只让本书失败，批量导出时不影响其他书的结果和日志
+            with global_context.timer.stage("archive"):
+                global_context.source.open()
+            print(">>> lake文件索引完成")
+        global_context.parser_backend = resolve_parser_backend(parser_backend)
+        print(">>> 正文解析后端: %s" % global_context.parser_backend)
+        with global_context.timer.stage("meta"):
+            load_meta_json(global_context)
         print(">>> meta json解析完成")
         global_context.download_image = download_image_of_in
         global_context.skip_existing = skip_existing
         abspath = os.path.abspath(output)
+        global_context.worker_book = (lake_book, meta, abspath, download_image_of_in, skip_existing,
+                                      global_context.parser_backend, toc_cache_dir)
+        if incremental:
+            global_context.manifest = ExportManifest(abspath, {
+                "download_image": bool(download_image_of_in),
+                "parser_backend": global_context.parser_backend,
+            })
         print(">>> 开始进行markdown转换")
         convert_to_md(global_context, abspath, open_output=open_output)
         print("共导出%s个文件" % global_context.file_count)
@@ -375,18 +729,138 @@ def start_convert(meta, lake_book, output, download_image_of_in, skip_existing=F
         print("图片下载错误列表:")
         print(' list: ', global_context.failure_image_download_list)
         print(' count:', len(global_context.failure_image_download_list))
+        result["unresolved_links"] = link_report(global_context.unresolved_links, abspath)
+        print("未解析的内部链接:")
+        for item in result["unresolved_links"]:
+            print(" - {doc}: [{title}]({src})".format(**item))
+        print(' count:', len(result["unresolved_links"]))
         result["success"] = True
         result["file_count"] = global_context.file_count
         result["failure_images"] = list(global_context.failure_image_download_list)
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        if shared_downloader is None:
+            # 并行导出时会话同时被其他 lakebook 使用，连接统计只在整批汇总
+            result["http_stats"] = diff_session_stats(session_stats_before, global_context.session.stats())
+        result["download_stats"] = dict(global_context.download_stats)
+        if global_context.manifest is not None:
+            result["incremental"] = dict(global_context.manifest.stats)
     except Exception as e:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
         print(e)
         result["error"] = str(e)
         result["traceback"] = traceback.format_exc()
+    finally:
+        global_context.source.close()
+        result["elapsed"] = round(time.perf_counter() - started_at, 3)
+        result["timings"] = global_context.timer.as_dict()
+        print(">>> 阶段耗时: %s" % format_stages(result["timings"]))
     return result
+
+
+def link_report(unresolved_links, output_path):
+    """
+    未解析的内部链接报告，文档路径相对于导出根目录，按文档路径排序
+    :return: [{"doc": 文档路径, "title": 链接标题, "src": 原链接}, ...]
+    """
+    report = [dict(item, doc=os.path.relpath(item["doc"], output_path).replace(os.path.sep, "/"))
+              for item in unresolved_links]
+    report.sort(key=lambda item: item["doc"])
+    return report
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class BatchProgress:
+    """
+    批量并行导出的汇总进度：所有 lakebook 的文档完成数、文档/秒、资源/秒和预计剩余时间，
+    最多每 interval 秒刷新一次同一行。文档总数在各 lakebook 展开目录后才累加，
+    还没开始的 lakebook 不计入剩余时间。
+    :param downloader: 共享的 ResourceDownloader，从它的统计中读取已完成的资源数
+    """
+
+    def __init__(self, downloader=None, interval=0.5):
+        self.downloader = downloader
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.printed_at = 0
+        self.total = 0
+        self.done = 0
+
+    def add_total(self, count):
+        with self.lock:
+            self.total += count
+
+    def advance(self):
+        with self.lock:
+            self.done += 1
+            now = time.monotonic()
+            if now - self.printed_at < self.interval:
+                return
+            self.printed_at = now
+            line = self.render(now)
+        print("\r" + line, end="", flush=True)
+
+    def resources_done(self):
+        if self.downloader is None:
+            return 0
+        with self.downloader.stats_lock:
+            return self.downloader.stats["downloaded"] + self.downloader.stats["cache_hits"]
+
+    def render(self, now):
+        elapsed = max(now - self.started_at, 1e-6)
+        docs_rate = self.done / elapsed
+        remaining = (self.total - self.done) / docs_rate if docs_rate else 0
+        return "batch progress: {}/{} docs, {:.1f} docs/s, {:.1f} images/s, ETA {}. ".format(
+            self.done, self.total, docs_rate, self.resources_done() / elapsed, format_duration(remaining))
+
+    def finish(self):
+        with self.lock:
+            line = self.render(time.monotonic())
+        print("\r" + line)
+
+
+def start_parallel_convert(books, download_image_of_in, skip_existing=False, open_output=False, parallel_books=2,
+                           download_options=None, session_options=None, asset_cache_dir=None, workers=1,
+                           parser_backend=None, incremental=False, toc_cache_dir=None, link_assets=False):
+    """
+    同时转换多个 lakebook。workers 和 download_options 中的下载并发数是整批共用的总预算：
+    所有 lakebook 共用一个 workers 进程的转换进程池（workers 为 1 时各自在线程中顺序转换）
+    和一个下载池，一个 lakebook 在下载资源时其他 lakebook 可以继续解析。
+    :param books: [(lakebook 路径, 输出目录), ...]
+    :param parallel_books: 同时处理的 lakebook 数
+    :return: 与 books 顺序一致的 start_convert 结果列表
+    """
+    session = get_shared_session(**(session_options or {}))
+    asset_store = AssetStore(asset_cache_dir, link=link_assets) if asset_cache_dir else None
+    workers = max(1, workers or 1)
+    convert_pool = None
+    if workers > 1:
+        convert_pool = ProcessPoolExecutor(max_workers=workers, initializer=init_book_worker,
+                                           initargs=(parallel_books,))
+    try:
+        with ResourceDownloader(session=session, asset_store=asset_store,
+                                **(download_options or {})) as shared_downloader:
+            progress = BatchProgress(shared_downloader)
+
+            def convert_book(book):
+                lake_book, output = book
+                return start_convert(None, lake_book, output, download_image_of_in, skip_existing,
+                                     open_output=open_output, download_options=download_options,
+                                     session_options=session_options, asset_cache_dir=asset_cache_dir,
+                                     workers=workers, parser_backend=parser_backend, incremental=incremental,
+                                     toc_cache_dir=toc_cache_dir, link_assets=link_assets,
+                                     shared_downloader=shared_downloader, convert_pool=convert_pool,
+                                     progress=progress)
+
+            with ThreadPoolExecutor(max_workers=max(1, parallel_books), thread_name_prefix="lake-book") as book_pool:
+                results = list(book_pool.map(convert_book, books))
+            progress.finish()
+    finally:
+        if convert_pool is not None:
+            convert_pool.shutdown()
+    return results
 # """
 # 已经完成到根据meta生成目录了
 # """
@@ -0,0 +1,93 @@
+"""
+导出流程的分阶段计时和计数。
+
+各阶段耗时按调用累加：多个转换进程或下载线程同时工作时，parse/emit/network 等阶段是所有进程/线程的累计耗时，
+可能大于整体的墙钟耗时。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# 阶段的显示顺序和含义
+STAGES = (
+    ("archive", "索引 lakebook"),
+    ("meta", "解析目录"),
+    ("read", "读取文档 json"),
+    ("parse", "解析正文"),
+    ("emit", "生成 Markdown"),
+    ("normalize", "整理 Markdown"),
+    ("write", "写出 Markdown"),
+    ("network", "下载资源"),
+    ("disk", "写出资源"),
+    ("wait", "等待下载完成"),
+)
+STAGE_LABELS = dict(STAGES)
+
+
+class StageTimer:
+    """
+    线程安全的阶段计时器：stage(name) 累加一个阶段的耗时和次数，count(name, n) 累加计数（文档数、字节数等）。
+    子进程中的计时器可以用 snapshot() 导出，由主进程 merge() 合并。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {阶段: [累计秒数, 次数]}
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds, calls=1):
+        with self.lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [seconds, calls]
+            else:
+                entry[0] += seconds
+                entry[1] += calls
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {name: tuple(entry) for name, entry in self.stages.items()}, dict(self.counters)
+
+    def merge(self, snapshot):
+        stages, counters = snapshot
+        for name, (seconds, calls) in stages.items():
+            self.add(name, seconds, calls)
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    def as_dict(self):
+        """
+        :return: {"stages": {阶段: {"seconds": 秒数, "calls": 次数}}, "counters": {计数名: 值}}
+        """
+        stages, counters = self.snapshot()
+        return {
+            "stages": {name: {"seconds": round(seconds, 4), "calls": calls} for name, (seconds, calls) in stages.items()},
+            "counters": counters,
+        }
+
+
+def format_stages(timings):
+    """
+    把 StageTimer.as_dict() 的结果格式化为一行，按 STAGES 的顺序输出
+    """
+    stages = (timings or {}).get("stages") or {}
+    names = [name for name, _ in STAGES if name in stages] + sorted(name for name in stages if name not in STAGE_LABELS)
+    return "，".join("{} {:.2f}s".format(STAGE_LABELS.get(name, name), stages[name]["seconds"]) for name in names)
+
+
+def format_counters(timings):
+    counters = (timings or {}).get("counters") or {}
+    return "，".join("{} {}".format(name, counters[name]) for name in sorted(counters))